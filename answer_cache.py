@@ -0,0 +1,100 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+
+# Configuration
+DB_PATH = os.getenv("DB_PATH", "chroma_db")
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", os.path.join(DB_PATH, "answer_cache.sqlite3"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+# Cosine similarity between two questions above which the stored answer is replayed
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+
+ARABIC_SCRIPT = re.compile(r"[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]")
+ENGLISH_WORDS = {"the", "what", "how", "is", "are", "can", "do", "does", "my", "i", "you", "to", "of", "and", "for", "which", "fees", "account", "card"}
+FRENCH_WORDS = {"le", "la", "les", "un", "une", "des", "est", "quel", "quels", "quelle", "quelles", "comment", "je", "mon", "ma", "mes", "de", "du", "pour", "et", "frais", "compte", "carte"}
+
+def query_language(text):
+    """Cheap language tag of a question ("ar", "en" or "fr"): the answer is written in the user's language."""
+    if ARABIC_SCRIPT.search(text):
+        return "ar"
+    words = re.findall(r"[a-zà-ÿ']+", text.lower())
+    english = sum(1 for w in words if w in ENGLISH_WORDS)
+    french = sum(1 for w in words if w in FRENCH_WORDS)
+    return "en" if english > french else "fr"
+
+def context_key(model, hits, language="fr"):
+    """
+    Key of a generation context: the model, the language of the question and the chunks placed in the
+    prompt (ID and content). When ingest() changes one of these chunks, the key changes and older
+    answers stop matching.
+    """
+    chunks = sorted((hit["id"], hashlib.sha256(hit["content"].encode("utf-8")).hexdigest()) for hit in hits)
+    payload = json.dumps([model, language, chunks], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class AnswerCache:
+    """
+    Persistent semantic cache of full LLM answers. An answer is reused for a near-duplicate question
+    (same context key, query embeddings above the threshold). Least recently used entries are evicted.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, maxsize=ANSWER_CACHE_SIZE, threshold=ANSWER_CACHE_THRESHOLD):
+        self.path = path
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY, context_key TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "question TEXT NOT NULL, answer TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_context ON answers (context_key)")
+        self._db.commit()
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+    def lookup(self, key, query_embedding):
+        """Return {"question", "answer", "score"} of the closest stored answer for this context, or None."""
+        query = self._normalize(query_embedding)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, embedding, question, answer FROM answers WHERE context_key = ?", (key,)
+            ).fetchall()
+            best = None
+            for row_id, blob, question, answer in rows:
+                score = float(np.dot(np.frombuffer(blob, dtype=np.float32), query))
+                if score >= self.threshold and (best is None or score > best[0]):
+                    best = (score, row_id, question, answer)
+            if best is None:
+                return None
+            score, row_id, question, answer = best
+            self._db.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), row_id))
+            self._db.commit()
+        return {"question": question, "answer": answer, "score": score}
+
+    def store(self, key, query_embedding, question, answer):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO answers (context_key, embedding, question, answer, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, self._normalize(query_embedding).tobytes(), question, answer, time.time())
+            )
+            self._db.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,)
+            )
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
@@ -1,9 +1,13 @@
 import streamlit as st
 import ollama
-import chromadb
-from chromadb.utils import embedding_functions
 import os
 import re
+import time
+from faq_index import stream_answer
+from chat_client import CHAT_API_URL, stream_chat, ServerBusyError
+from model_registry import ModelRegistry
+from metrics import RequestTrace, start_metrics_server
+from warmup import start_warm_up, OLLAMA_KEEP_ALIVE
 
 # --- PAGE CONFIG ---
 st.set_page_config(
@@ -13,11 +17,10 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# --- CONFIGURATION RAG ---
-DB_PATH = os.getenv("DB_PATH", "chroma_db")
-COLLECTION_NAME = os.getenv("COLLECTION_NAME", "bnm_qa")
+# --- CONFIGURATION ---
+# With CHAT_API_URL set, retrieval and generation run in chat_server.py and this script is a thin client.
+# Otherwise the RAG pipeline runs in-process.
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-DISTANCE_THRESHOLD = 0.70 
 
 # --- STYLING (Final Hybrid: V4 Main + V7 Sidebar + Symmetrical Traits) ---
 def apply_custom_styles():
@@ -63,6 +66,18 @@ def apply_custom_styles():
             border: 1px solid #c3e6cb;
         }
 
+        .status-box.status-error {
+            background-color: #fdecea;
+            color: #a71d2a;
+            border-color: #f5c6cb;
+        }
+
+        .status-box.status-pending {
+            background-color: #f1f5f9;
+            color: #475569;
+            border-color: #e2e8f0;
+        }
+
         /* Message Styling (Symmetrical Traits) */
         /* Hide Avatars */
         [data-testid="stChatMessageAvatarUser"], 
@@ -126,82 +141,111 @@ def apply_custom_styles():
 apply_custom_styles()
 
 # --- UTILS ---
-@st.cache_resource
-def get_chroma_client():
-    return chromadb.PersistentClient(path=DB_PATH)
+# Prometheus /metrics on METRICS_PORT for the in-process mode (chat_server.py serves its own)
+start_metrics_server()
 
 @st.cache_resource
-def get_embedding_model():
-    return embedding_functions.SentenceTransformerEmbeddingFunction(model_name="paraphrase-multilingual-MiniLM-L12-v2")
+def get_rag_pipeline():
+    # Imported lazily: a thin client never loads the embedding model or Chroma
+    from rag_pipeline import get_pipeline
+    return get_pipeline()
 
 client_ollama = ollama.Client(host=OLLAMA_HOST)
 
-def get_rag_context(query):
+@st.cache_resource
+def get_model_registry():
+    # Shared by every session; refreshes the Ollama model list in a background thread
+    return ModelRegistry(client_ollama)
+
+@st.cache_resource
+def start_local_warm_up():
+    # In-process mode only. Under `python warmup.py --streamlit` the warm-up already started with the
+    # server and this returns it; under a plain `streamlit run` it starts with the first session.
+    return start_warm_up(get_rag_pipeline(), client_ollama)
+
+if not CHAT_API_URL:
+    start_local_warm_up()
+
+def local_chat_stream(messages, model, meta, status=None):
+    """In-process equivalent of the chat server: fills `meta` and yields answer tokens."""
+    trace = RequestTrace(model=model)
     try:
-        if not os.path.exists(DB_PATH):
-            return None, None
-            
-        client = get_chroma_client()
-        embedding_function = get_embedding_model()
-        collection = client.get_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
-        
-        # Increased n_results for better context coverage
-        results = collection.query(query_texts=[query], n_results=5)
-        
-        if results['documents'] and len(results['documents'][0]) > 0:
-            relevant_docs = []
-            sources = []
-            for doc, dist, meta in zip(results['documents'][0], results['distances'][0], results['metadatas'][0]):
-                if dist < DISTANCE_THRESHOLD:
-                    relevant_docs.append(doc)
-                    sources.append(meta.get("source", "Inconnu"))
-            
-            if relevant_docs:
-                return "\n---\n".join(relevant_docs), list(set(sources))
-            
-    except Exception:
-        pass
-    return None, None
+        turn = get_rag_pipeline().prepare_chat(messages, trace, model)
+        meta["sources"] = turn["sources"]
+        replay = turn["faq"] or turn["cached"]
+        if replay:
+            trace.set(path="faq" if turn["faq"] else "answer_cache")
+            yield from stream_answer(replay["answer"])
+            return
+
+        # RÈGLE : STREAMING ACTIVÉ
+        trace.set(path="llm")
+        started = time.perf_counter()
+        first_token = True
+        parts = []
+        response_stream = client_ollama.chat(model=model, messages=turn["messages"], stream=True, keep_alive=OLLAMA_KEEP_ALIVE)
+        for chunk in response_stream:
+            if 'message' in chunk and 'content' in chunk['message'] :
+                if first_token:
+                    trace.record("ollama_ttft", time.perf_counter() - started)
+                    first_token = False
+                parts.append(chunk['message']['content'])
+                yield chunk['message']['content']
+        trace.record("ollama_generation", time.perf_counter() - started)
+        get_rag_pipeline().remember_answer(turn, "".join(parts))
+    except Exception as e:
+        trace.error("generation", e)
+        raise
+    finally:
+        trace.finish()
+
+def api_chat_stream(messages, model, meta, status=None):
+    """Relay the chat server's SSE stream: fills `meta`, shows the queue position in `status` and yields answer tokens."""
+    waiting = False
+    for event, data in stream_chat(messages, model):
+        if event == "meta":
+            meta["sources"] = data.get("sources", [])
+        elif event == "queue":
+            waiting = True
+            if status is not None:
+                status.info(f"Forte affluence : vous êtes en position {data['position']} dans la file d'attente...")
+        elif event == "token":
+            if waiting and status is not None:
+                status.empty()
+                waiting = False
+            yield data["content"]
+        elif event == "error":
+            if waiting and status is not None:
+                status.empty()
+            if data.get("code") == "queue_full":
+                # The queue filled up after the server accepted the request: same warning as a 503
+                raise ServerBusyError(data.get("message", "Service saturé"))
+            raise RuntimeError(data.get("message", "erreur inconnue"))
 
 # --- UI CONTENT ---
 # Sidebar (Restoring V7 Functional Style)
 with st.sidebar:
     st.title("État du système")
-    st.markdown('<div class="status-box">Ollama est prêt.</div>', unsafe_allow_html=True)
+    registry = get_model_registry()
+    ollama_healthy = registry.healthy
+    if ollama_healthy:
+        st.markdown('<div class="status-box">Ollama est prêt.</div>', unsafe_allow_html=True)
+    elif ollama_healthy is None:
+        st.markdown('<div class="status-box status-pending">Connexion à Ollama en cours...</div>', unsafe_allow_html=True)
+    else:
+        st.markdown('<div class="status-box status-error">Ollama est injoignable.</div>', unsafe_allow_html=True)
     st.markdown("---")
     st.markdown("### Modèle")
-    model_choice = st.selectbox("Sélectionner un modèle", ["qwen2.5:1.5b", "qwen2.5:7b"], label_visibility="collapsed")
-    
+    model_options = ["qwen2.5:1.5b", "qwen2.5:7b"]
 
-    # Check if model is available
-    try:
-        models_info = client_ollama.list()
-        
-        # Handle response being either a dict or an object
-        if isinstance(models_info, dict):
-             models_list = models_info.get('models', [])
-        else:
-             models_list = getattr(models_info, 'models', [])
-
-        available_models = []
-        for m in models_list:
-            # Handle item being either a dict or an object
-            if isinstance(m, dict):
-                model_name = m.get('name') or m.get('model')
-            else:
-                model_name = getattr(m, 'name', getattr(m, 'model', None))
-            
-            if model_name:
-                available_models.append(model_name)
-        
-        # Check for partial matches (e.g. qwen2.5:7b:latest)
-        is_model_available = any(model_choice in m for m in available_models)
-        
-        if not is_model_available:
-            st.warning(f"⚠️ Le modèle '{model_choice}' n'est pas téléchargé.")
-            
-    except Exception:
-        pass
+    def format_model(model):
+        # Models known to be missing are shown greyed out (labelled) rather than hidden
+        return f"{model} (indisponible)" if registry.is_available(model) is False else model
+
+    model_choice = st.selectbox("Sélectionner un modèle", model_options, format_func=format_model, label_visibility="collapsed")
+
+    if registry.is_available(model_choice) is False:
+        st.warning(f"⚠️ Le modèle '{model_choice}' n'est pas téléchargé.")
 
     st.markdown("---")
     if st.button("Effacer la conversation"):
@@ -227,49 +271,17 @@ if prompt := st.chat_input("Posez votre question sur la BNM..."):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        context, sources = get_rag_context(prompt)
-        
-        # --- DETECT MANUAL FAQ HIT ---
-        is_manual_hit = any("manual_qa.json" in str(s) for s in (sources if sources else []))
-        
-        # --- STRICT & HARDENED SYSTEM PROMPT ---
-        system_prompt = f"""Tu es l'Expert IA exclusif de la Banque Nationale de Mauritanie (BNM).
-        
-TON IDENTITÉ & SOURCE UNIQUE :
-- Ton organisation est la Banque Nationale de Mauritanie (Mauritanie).
-- Tu RÉPONDS UNIQUEMENT en utilisant les informations contenues dans le CONTEXTE DOCUMENTAIRE fourni ci-dessous.
-- Tu n'as AUCUNE CULTURE GÉNÉRALE. Si une information n'est pas dans le contexte, tu ne la connais pas du tout.
-- INTERDICTION FORMELLE d'inventer, de supposer ou d'ajouter des détails qui ne sont pas explicitement écrits.
-{"- NOTE : Le contexte contient une réponse provenant d'une FAQ manuelle officielle. Utilise cette réponse EXACTEMENT telle quelle sans la modifier." if is_manual_hit else ""}
-
-RÈGLES DE RÉPONSE :
-1. PRÉCISION ABSOLUE : Réponds directement à la question sans fioritures.
-2. PAS D'HALLUCINATION : Si l'info manque, dis : "Je suis désolé, je n'ai pas cette information dans mes documents officiels."
-3. FIDÉLITÉ : Si l'utilisateur pose une question reformulée, trouve l'information correspondante dans le contexte.
-4. ALIGNEMENT LINGUISTIQUE (CRITIQUE) : Réponds SYSTÉMATIQUEMENT dans la langue utilisée par l'utilisateur (Arabe, Anglais ou Français).
-
-CONTEXTE DOCUMENTAIRE :
-{context if context else 'AUCUN DOCUMENT DISPONIBLE. Refuse de répondre poliment.'}
-"""
-
         try:
-            # RÈGLE : STREAMING ACTIVÉ
-            response_stream = client_ollama.chat(
-                model=model_choice,
-                messages=[{"role": "system", "content": system_prompt}] + st.session_state.messages[-5:],
-                stream=True
-            )
-            
-            def generate_stream():
-                for chunk in response_stream:
-                    if 'message' in chunk and 'content' in chunk['message'] :
-                        yield chunk['message']['content']
-            
-            full_response = st.write_stream(generate_stream())
+            meta = {}
+            status = st.empty()
+            chat_stream = api_chat_stream if CHAT_API_URL else local_chat_stream
+            full_response = st.write_stream(chat_stream(st.session_state.messages, model_choice, meta, status))
             st.session_state.messages.append({"role": "assistant", "content": full_response})
             
-            if sources:
-                st.caption(f"Sources : {', '.join(sources)}")
+            if meta.get("sources"):
+                st.caption(f"Sources : {', '.join(meta['sources'])}")
             
+        except ServerBusyError as e:
+            st.warning(str(e))
         except Exception as e:
             st.error(f"Incident technique : {e}")
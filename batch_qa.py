@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import ollama
+from rag_pipeline import get_pipeline
+from metrics import RequestTrace
+from benchmark_data import percentiles
+
+# Configuration
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "qwen2.5:1.5b")
+# Number of generations sent to Ollama at the same time
+CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# Questions embedded and searched together before their retrieval (stays under the in-memory query cache size)
+EMBED_BLOCK = 256
+RESULTS_DIR = "benchmarks"
+
+def load_questions(path):
+    """JSONL with a "question" per line, plus an optional "id" (defaults to the line number)."""
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                item = json.loads(line)
+                questions.append({"id": str(item.get("id", i)), "question": item["question"]})
+    return questions
+
+def load_done(path):
+    """IDs already answered in an existing output file, so an interrupted run can resume."""
+    done = set()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if not record.get("error"):
+                    done.add(record["id"])
+    return done
+
+async def answer_one(pipeline, client, item, model, use_answer_cache, semaphore):
+    """Retrieval and prompt exactly as in the chat, then one generation under the concurrency limit."""
+    messages = [{"role": "user", "content": item["question"]}]
+    trace = RequestTrace(model=model)
+    record = {"id": item["id"], "question": item["question"], "answer": "", "path": None,
+              "sources": [], "hits": [], "timings_ms": {}, "error": None}
+    started = time.perf_counter()
+    try:
+        turn = await asyncio.to_thread(pipeline.prepare_chat, messages, trace, model if use_answer_cache else None)
+        record["timings_ms"]["retrieval"] = round((time.perf_counter() - started) * 1000, 1)
+        record["sources"] = turn["sources"]
+        # Retrieved chunks (none for FAQ answers, which skip the retrieval)
+        record["hits"] = [{"id": h["id"], "source": h["metadata"].get("source"), "distance": h["distance"]}
+                          for h in turn.get("hits", [])]
+
+        replay = turn["faq"] or turn["cached"]
+        if replay:
+            record["path"] = "faq" if turn["faq"] else "answer_cache"
+            record["answer"] = replay["answer"]
+        else:
+            record["path"] = "llm"
+            async with semaphore:
+                generation_started = time.perf_counter()
+                response = await client.chat(model=model, messages=turn["messages"])
+            record["timings_ms"]["generation"] = round((time.perf_counter() - generation_started) * 1000, 1)
+            record["answer"] = response["message"]["content"]
+            if use_answer_cache:
+                await asyncio.to_thread(pipeline.remember_answer, turn, record["answer"])
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        trace.error("batch", e)
+    record["timings_ms"]["total"] = round((time.perf_counter() - started) * 1000, 1)
+    trace.finish(path=record["path"], batch_id=item["id"])
+    return record
+
+async def run_batch(questions, output, model=DEFAULT_MODEL, concurrency=CONCURRENCY, use_answer_cache=True):
+    pipeline = get_pipeline()
+    client = ollama.AsyncClient(host=OLLAMA_HOST)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"answered": 0, "errors": 0, "paths": {}}
+    totals = []
+    started = time.perf_counter()
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "a", encoding="utf-8") as f:
+        for start in range(0, len(questions), EMBED_BLOCK):
+            block = questions[start:start + EMBED_BLOCK]
+            # One batched pass through the embedding model and batched Chroma queries for the whole block
+            await asyncio.to_thread(pipeline.prefetch_queries, [item["question"] for item in block])
+            tasks = [asyncio.create_task(answer_one(pipeline, client, item, model, use_answer_cache, semaphore))
+                     for item in block]
+            for task in asyncio.as_completed(tasks):
+                record = await task
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                if record["error"]:
+                    stats["errors"] += 1
+                else:
+                    stats["answered"] += 1
+                    stats["paths"][record["path"]] = stats["paths"].get(record["path"], 0) + 1
+                    totals.append(record["timings_ms"]["total"])
+            print(f"{min(start + EMBED_BLOCK, len(questions))}/{len(questions)} questions traitées...")
+
+    stats["elapsed_s"] = round(time.perf_counter() - started, 1)
+    stats["latency_ms"] = percentiles(totals)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Réponses en lot à un fichier JSONL de questions (retrieval + génération).")
+    parser.add_argument("questions", help="JSONL de questions : {\"id\": ..., \"question\": ...}")
+    parser.add_argument("--output", help="JSONL de sortie (défaut: benchmarks/answers_<date>.jsonl)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Générations simultanées")
+    parser.add_argument("--fresh", action="store_true", help="Ne pas utiliser ni alimenter le cache de réponses")
+    args = parser.parse_args()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"answers_{time.strftime('%Y%m%d_%H%M%S')}.jsonl")
+    questions = load_questions(args.questions)
+    done = load_done(output)
+    pending = [item for item in questions if item["id"] not in done]
+    if done:
+        print(f"Reprise : {len(questions) - len(pending)} questions déjà traitées dans {output}.")
+    if not pending:
+        print("Aucune question à traiter.")
+        return
+
+    print(f"{len(pending)} questions, modèle {args.model}, {args.concurrency} générations simultanées...")
+    stats = asyncio.run(run_batch(pending, output, args.model, args.concurrency, not args.fresh))
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    print(f"Réponses écrites dans {output}")
+
+if __name__ == "__main__":
+    main()
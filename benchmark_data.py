@@ -0,0 +1,64 @@
+import os
+import json
+import math
+
+# Configuration
+MANUAL_QA_PATH = "manual_qa.json"
+
+# Reformulations automatiques des questions de la FAQ (en plus d'un éventuel fichier de questions)
+PARAPHRASE_TEMPLATES = [
+    "{q}",
+    "{bare}",
+    "Pouvez-vous m'expliquer : {bare} ?",
+    "j'aimerais savoir {bare}",
+]
+
+def percentiles(values, points=(50, 90, 95, 99)):
+    """Nearest-rank percentiles of a list of numbers, in the same unit."""
+    if not values:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        rank = max(1, min(len(ordered), math.ceil(p / 100 * len(ordered))))
+        result[f"p{p}"] = round(ordered[rank - 1], 3)
+    result["mean"] = round(sum(ordered) / len(ordered), 3)
+    return result
+
+def load_question_set(questions_path=None, with_paraphrases=True):
+    """
+    Questions as dicts {"question", "expected_ids", "expected_sources", "kind"}.
+    Every manual QA pair expects its own chunk (manual_qa_<i>); an optional JSONL file can add
+    more questions with "expected_ids" and/or "expected_sources".
+    """
+    questions = []
+    if os.path.exists(MANUAL_QA_PATH):
+        with open(MANUAL_QA_PATH, "r", encoding="utf-8") as f:
+            manual_qa = json.load(f)
+        for i, qa in enumerate(manual_qa):
+            q = qa.get("question", "").strip()
+            if not q or not qa.get("answer"):
+                continue
+            bare = q.rstrip(" ?").strip()
+            bare = bare[0].lower() + bare[1:] if bare else bare
+            templates = PARAPHRASE_TEMPLATES if with_paraphrases else PARAPHRASE_TEMPLATES[:1]
+            for j, template in enumerate(templates):
+                questions.append({
+                    "question": template.format(q=q, bare=bare),
+                    "expected_ids": [f"manual_qa_{i}"],
+                    "expected_sources": [],
+                    "kind": "manual" if j == 0 else "paraphrase",
+                })
+
+    if questions_path:
+        with open(questions_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    questions.append({
+                        "question": item["question"],
+                        "expected_ids": item.get("expected_ids", []),
+                        "expected_sources": item.get("expected_sources", []),
+                        "kind": item.get("kind", "custom"),
+                    })
+    return questions
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import argparse
+import chromadb
+from embedding_service import get_embedding_service, get_collection
+from rag_pipeline import RAGPipeline, DB_PATH, COLLECTION_NAME, DISTANCE_THRESHOLD, N_RESULTS
+from rag_cache import normalize_query
+from reranker import get_reranker, RERANK, RERANK_TOP_K
+from benchmark_data import load_question_set, percentiles
+
+# Configuration
+RESULTS_DIR = "benchmarks"
+K_VALUES = (1, 3, 5, 10)
+
+def first_relevant_rank(ids, metadatas, question):
+    """1-based rank of the first relevant result, or None."""
+    for rank, (doc_id, meta) in enumerate(zip(ids, metadatas), start=1):
+        if doc_id in question["expected_ids"] or (meta or {}).get("source") in question["expected_sources"]:
+            return rank
+    return None
+
+def run_benchmark(questions, k_max=max(K_VALUES), hybrid=True):
+    embedding_service = get_embedding_service()
+    client = chromadb.PersistentClient(path=DB_PATH)
+    collection = get_collection(client, COLLECTION_NAME)
+    pipeline = RAGPipeline() if hybrid else None
+    reranker = get_reranker() if hybrid and RERANK else None
+    # retrieve() returns at most this many chunks: deeper hybrid recall would be meaningless
+    hybrid_k = RERANK_TOP_K if reranker is not None else N_RESULTS
+
+    embed_ms, search_ms, hybrid_ms = [], [], []
+    dense_ranks, hybrid_ranks = [], []
+    under_threshold = 0
+    per_question = []
+
+    embedding_service.encode(["warm-up"])
+    for question in questions:
+        # Timed without the embedding cache so the numbers reflect the model
+        started = time.perf_counter()
+        embedding = embedding_service.encode([question["question"]])[0]
+        embed_ms.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        results = collection.query(query_embeddings=[embedding], n_results=k_max)
+        search_ms.append((time.perf_counter() - started) * 1000)
+
+        ids = results["ids"][0]
+        distances = results["distances"][0]
+        rank = first_relevant_rank(ids, results["metadatas"][0], question)
+        dense_ranks.append(rank)
+        if distances and distances[0] < DISTANCE_THRESHOLD:
+            under_threshold += 1
+
+        entry = {"question": question["question"], "kind": question["kind"], "dense_rank": rank,
+                 "top_id": ids[0] if ids else None, "top_distance": distances[0] if distances else None}
+
+        if pipeline is not None:
+            # No cache hits: "{q}" and "{bare}" share a normalized query. The embedding just computed
+            # by the model is handed over, so hybrid_retrieve times the retrieval only (like "search")
+            pipeline.cache.results.clear()
+            pipeline.cache.embeddings.clear()
+            pipeline.cache.embeddings.put(normalize_query(question["question"]), embedding)
+            if reranker is not None:
+                reranker.scores.clear()
+            started = time.perf_counter()
+            hits = pipeline.retrieve(question["question"])
+            hybrid_ms.append((time.perf_counter() - started) * 1000)
+            hybrid_rank = first_relevant_rank([h["id"] for h in hits], [h["metadata"] for h in hits], question)
+            hybrid_ranks.append(hybrid_rank)
+            entry["hybrid_rank"] = hybrid_rank
+        per_question.append(entry)
+
+    def ranking_metrics(ranks, k_limit=k_max):
+        n = len(ranks) or 1
+        metrics = {f"recall@{k}": round(sum(1 for r in ranks if r and r <= k) / n, 4) for k in K_VALUES if k <= k_limit}
+        metrics["mrr"] = round(sum(1.0 / r for r in ranks if r) / n, 4)
+        return metrics
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "collection": COLLECTION_NAME,
+            "collection_size": collection.count(),
+            "embedding_model": embedding_service.model_name,
+            "distance_threshold": DISTANCE_THRESHOLD,
+            "k_max": k_max,
+            "hybrid_k": hybrid_k if pipeline is not None else None,
+            "questions": len(questions),
+        },
+        "dense": ranking_metrics(dense_ranks),
+        "hit_rate_under_threshold": round(under_threshold / (len(questions) or 1), 4),
+        "latency_ms": {"embedding": percentiles(embed_ms), "search": percentiles(search_ms)},
+        "per_question": per_question,
+    }
+    if pipeline is not None:
+        report["hybrid"] = ranking_metrics(hybrid_ranks, min(k_max, hybrid_k))
+        report["latency_ms"]["hybrid_retrieve"] = percentiles(hybrid_ms)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la recherche documentaire (qualité et latence).")
+    parser.add_argument("--questions", help="JSONL de questions supplémentaires (question, expected_ids, expected_sources)")
+    parser.add_argument("--no-paraphrases", action="store_true", help="N'utiliser que les questions de la FAQ telles quelles")
+    parser.add_argument("--no-hybrid", action="store_true", help="Ne pas évaluer la recherche hybride du pipeline")
+    parser.add_argument("--k", type=int, default=max(K_VALUES), help="Nombre de résultats demandés à Chroma")
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/retrieval_<date>.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(DB_PATH):
+        print(f"Error: {DB_PATH} not found.")
+        return
+
+    questions = load_question_set(args.questions, with_paraphrases=not args.no_paraphrases)
+    if not questions:
+        print("No questions to replay.")
+        return
+
+    print(f"Replaying {len(questions)} questions against '{COLLECTION_NAME}'...")
+    report = run_benchmark(questions, k_max=args.k, hybrid=not args.no_hybrid)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    summary = {key: report[key] for key in ("dense", "hybrid", "hit_rate_under_threshold", "latency_ms") if key in report}
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import os
+import re
+import json
+import math
+import unicodedata
+from collections import Counter
+
+# Configuration
+DB_PATH = os.getenv("DB_PATH", "chroma_db")
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", os.path.join(DB_PATH, "bm25_index.json"))
+RRF_K = 60
+
+# Mots vides FR/EN : sans eux, une question quelconque remonterait des chunks au hasard
+STOPWORDS = set("""
+a au aux avec ce ces cette dans de des du elle en est et il ils je la le les leur lui ma mais me mes
+mon ne nos notre nous on ou par pas pour qu que quel quelle quelles quels qui sa se ses son sont sur
+ta te tes toi ton tu un une vos votre vous y c d j l m n s t est-ce comment combien quoi
+the of and or to in is are what how which for on with an be do does my your i you it
+""".split())
+
+def tokenize(text):
+    """Lower-case, strip accents and split on word characters ("Crédoc" -> "credoc")."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r"\w+", text) if t not in STOPWORDS]
+
+class BM25Index:
+    """Okapi BM25 over the chunk IDs of the Chroma collection, with an inverted index for fast queries."""
+
+    def __init__(self, ids=None, doc_lens=None, postings=None, k1=1.5, b=0.75):
+        self.ids = ids or []
+        self.doc_lens = doc_lens or []
+        self.postings = postings or {}
+        self.k1 = k1
+        self.b = b
+        self.avgdl = (sum(self.doc_lens) / len(self.doc_lens)) if self.doc_lens else 0.0
+        n = len(self.ids)
+        self.idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+
+    @classmethod
+    def build(cls, ids, texts):
+        doc_lens = []
+        postings = {}
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lens.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append([i, tf])
+        return cls(list(ids), doc_lens, postings)
+
+    @classmethod
+    def from_collection(cls, collection, page_size=1000):
+        """Build the index from every document currently stored in the collection."""
+        ids, texts = [], []
+        offset = 0
+        while True:
+            page = collection.get(include=["documents"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            ids.extend(page["ids"])
+            texts.extend(doc or "" for doc in page["documents"])
+            offset += len(page["ids"])
+        return cls.build(ids, texts)
+
+    def save(self, path=BM25_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"ids": self.ids, "doc_lens": self.doc_lens, "postings": self.postings}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=BM25_INDEX_PATH):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["ids"], data["doc_lens"], data["postings"])
+
+    def search(self, query, k=5, allowed_ids=None):
+        """Return up to k (chunk_id, score) pairs, best first, optionally among `allowed_ids` only."""
+        scores = {}
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for i, tf in plist:
+                if allowed_ids is not None and self.ids[i] not in allowed_ids:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[i] / self.avgdl)
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[i], score) for i, score in best]
+
+    def __len__(self):
+        return len(self.ids)
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Merge several ranked lists of IDs: score(id) = sum(1 / (k + rank))."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
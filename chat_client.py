@@ -0,0 +1,34 @@
+import os
+import json
+import httpx
+
+# Configuration
+CHAT_API_URL = os.getenv("CHAT_API_URL", "")
+
+class ServerBusyError(Exception):
+    """The chat server rejected the request because the model's queue is full."""
+
+def iter_sse_events(lines):
+    """Parse Server-Sent Events from an iterable of text lines into (event, data) tuples."""
+    event, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+    if data:
+        yield event, json.loads("\n".join(data))
+
+def stream_chat(messages, model, api_url=CHAT_API_URL, timeout=None):
+    """Call the chat server and yield its (event, data) tuples as they arrive."""
+    with httpx.stream("POST", f"{api_url.rstrip('/')}/chat", json={"messages": messages, "model": model},
+                      timeout=timeout) as response:
+        if response.status_code == 503:
+            response.read()
+            raise ServerBusyError(response.json().get("error", "Service saturé"))
+        response.raise_for_status()
+        yield from iter_sse_events(response.iter_lines())
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import asyncio
+import httpx
+import ollama
+from aiohttp import web
+from rag_pipeline import get_pipeline
+from faq_index import stream_answer
+from ollama_scheduler import OllamaScheduler, QueueFullError
+from model_registry import ModelRegistry
+from metrics import REGISTRY, RequestTrace
+from warmup import start_warm_up, WARMUP_MODELS, OLLAMA_KEEP_ALIVE
+
+# Configuration
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+CHAT_API_HOST = os.getenv("CHAT_API_HOST", "0.0.0.0")
+CHAT_API_PORT = int(os.getenv("CHAT_API_PORT", "8000"))
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "qwen2.5:1.5b")
+# Size of the shared HTTP connection pool to Ollama
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "32"))
+
+async def send_event(response, event, data):
+    """Write one Server-Sent Event."""
+    payload = json.dumps(data, ensure_ascii=False)
+    await response.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+
+async def handle_chat(request):
+    """
+    POST /chat {"messages": [{"role", "content"}, ...], "model": "...", "answer_cache": true}
+    Streams `meta`, then `token` events, then `done` (or `error`) as text/event-stream.
+    "answer_cache": false neither replays nor stores a cached answer (load tests, evaluations).
+    """
+    try:
+        body = await request.json()
+        messages = body["messages"]
+        if not messages or messages[-1].get("role") != "user":
+            raise ValueError("the last message must come from the user")
+    except Exception as e:
+        return web.json_response({"error": f"Invalid request: {e}"}, status=400)
+    model = body.get("model") or DEFAULT_MODEL
+    use_answer_cache = body.get("answer_cache", True) is not False
+
+    # Unknown models are refused: each name would get its own scheduler budget and metrics labels
+    scheduler = request.app["scheduler"]
+    known = isinstance(model, str) and (
+        model == DEFAULT_MODEL or scheduler.is_configured(model) or request.app["models"].is_known(model))
+    if not known:
+        return web.json_response({"error": f"Invalid request: unknown model {model!r}"}, status=400)
+
+    # Fast rejection before doing any retrieval work
+    if scheduler.is_full(model):
+        scheduler.rejected += 1
+        REGISTRY.inc("bnm_rejected_total", help="Requests rejected because the model queue was full", model=model)
+        return web.json_response(
+            {"error": "Le service est saturé, veuillez réessayer dans un instant."},
+            status=503, headers={"Retry-After": "5"},
+        )
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+
+    trace = RequestTrace(model=model)
+    turn = None
+    try:
+        # Embedding and vector search are CPU-bound: keep them off the event loop
+        turn = await asyncio.to_thread(request.app["pipeline"].prepare_chat, messages, trace,
+                                       model if use_answer_cache else None)
+        await send_event(response, "meta", {"sources": turn["sources"], "faq": bool(turn["faq"]), "cached": bool(turn["cached"])})
+
+        replay = turn["faq"] or turn["cached"]
+        if replay:
+            for piece in stream_answer(replay["answer"]):
+                await send_event(response, "token", {"content": piece})
+            trace.set(path="faq" if turn["faq"] else "answer_cache")
+        else:
+            async def on_position(position):
+                trace.count("queued")
+                await send_event(response, "queue", {"position": position})
+
+            queued_at = time.perf_counter()
+            async with scheduler.slot(model, on_position):
+                trace.record("queue_wait", time.perf_counter() - queued_at)
+                started = time.perf_counter()
+                first_token_at = None
+                tokens = 0
+                parts = []
+                completed = False
+                stream = await request.app["ollama"].chat(model=model, messages=turn["messages"], stream=True,
+                                                          keep_alive=OLLAMA_KEEP_ALIVE)
+                async for chunk in stream:
+                    if 'message' in chunk and chunk['message'].get('content'):
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            trace.record("ollama_ttft", first_token_at - started)
+                        tokens += 1
+                        parts.append(chunk['message']['content'])
+                        await send_event(response, "token", {"content": chunk['message']['content']})
+                    if chunk.get('done'):
+                        completed = True
+                        # Real counts from Ollama: a low prompt_eval_count means the prefix was reused
+                        trace.set(prompt_eval_count=chunk.get('prompt_eval_count'), eval_count=chunk.get('eval_count'))
+                finished = time.perf_counter()
+                trace.record("ollama_generation", finished - started)
+                if first_token_at is not None and finished > first_token_at:
+                    rate = tokens / (finished - first_token_at)
+                    trace.set(tokens_per_second=round(rate, 2))
+                    REGISTRY.observe("bnm_tokens_per_second", rate, help="Ollama stream rate after the first token",
+                                     buckets=(1, 2, 5, 10, 20, 40, 80, 160), model=model)
+            trace.set(path="llm", streamed_chunks=tokens)
+            if completed:
+                await asyncio.to_thread(request.app["pipeline"].remember_answer, turn, "".join(parts))
+
+        await send_event(response, "done", {})
+    except QueueFullError as e:
+        trace.count("queue_full")
+        await send_event(response, "error", {"message": str(e), "code": "queue_full"})
+    except ConnectionResetError as e:
+        # The client went away; nothing left to send
+        trace.error("client", e)
+        trace.finish()
+        return response
+    except Exception as e:
+        trace.error("generation", e)
+        await send_event(response, "error", {"message": str(e)})
+
+    trace.finish(sources=turn["sources"] if turn else [])
+    await response.write_eof()
+    return response
+
+async def handle_metrics(request):
+    return web.Response(text=REGISTRY.render(), content_type="text/plain")
+
+async def handle_health(request):
+    return web.json_response({"status": "ok", "scheduler": request.app["scheduler"].status()})
+
+async def handle_ready(request):
+    """Readiness probe: 503 until the warm-up has loaded the models and run a first query."""
+    status = request.app["readiness"].status()
+    return web.json_response(status, status=200 if status["ready"] else 503)
+
+async def on_startup(app):
+    app["pipeline"] = get_pipeline()
+    app["scheduler"] = OllamaScheduler.from_env()
+    # Installed models, refreshed in the background: lets clients pick a model missing from OLLAMA_MAX_IN_FLIGHT
+    app["models"] = ModelRegistry(ollama.Client(host=OLLAMA_HOST))
+    # One AsyncClient for every session: its httpx pool keeps connections to Ollama alive
+    app["ollama"] = ollama.AsyncClient(
+        host=OLLAMA_HOST,
+        limits=httpx.Limits(max_connections=OLLAMA_POOL_SIZE, max_keepalive_connections=OLLAMA_POOL_SIZE),
+        timeout=httpx.Timeout(None, connect=10.0),
+    )
+    # Preload in the background: /health answers right away, /ready once the warm-up is done
+    app["readiness"] = start_warm_up(app["pipeline"], ollama.Client(host=OLLAMA_HOST), WARMUP_MODELS)
+
+async def on_cleanup(app):
+    await app["ollama"].close()
+
+def create_app():
+    app = web.Application()
+    app.router.add_post("/chat", handle_chat)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/ready", handle_ready)
+    app.router.add_get("/metrics", handle_metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=CHAT_API_HOST, port=CHAT_API_PORT)
@@ -0,0 +1,99 @@
+import os
+import math
+
+# Configuration
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Rough chars-per-token ratio of the Qwen tokenizer on French text; only used for budgeting
+CHARS_PER_TOKEN = 3.5
+# Longest overlap to look for between two chunks (the splitter uses chunk_overlap=150)
+MAX_OVERLAP = 200
+MIN_OVERLAP = 20
+
+# Static part of the system prompt. It must stay byte-identical across turns and come first,
+# so that Ollama can reuse the KV cache of this prefix instead of re-evaluating it.
+STATIC_SYSTEM_PROMPT = """Tu es l'Expert IA exclusif de la Banque Nationale de Mauritanie (BNM).
+
+TON IDENTITÉ & SOURCE UNIQUE :
+- Ton organisation est la Banque Nationale de Mauritanie (Mauritanie).
+- Tu RÉPONDS UNIQUEMENT en utilisant les informations contenues dans le CONTEXTE DOCUMENTAIRE fourni ci-dessous.
+- Tu n'as AUCUNE CULTURE GÉNÉRALE. Si une information n'est pas dans le contexte, tu ne la connais pas du tout.
+- INTERDICTION FORMELLE d'inventer, de supposer ou d'ajouter des détails qui ne sont pas explicitement écrits.
+
+RÈGLES DE RÉPONSE :
+1. PRÉCISION ABSOLUE : Réponds directement à la question sans fioritures.
+2. PAS D'HALLUCINATION : Si l'info manque, dis : "Je suis désolé, je n'ai pas cette information dans mes documents officiels."
+3. FIDÉLITÉ : Si l'utilisateur pose une question reformulée, trouve l'information correspondante dans le contexte.
+4. ALIGNEMENT LINGUISTIQUE (CRITIQUE) : Réponds SYSTÉMATIQUEMENT dans la langue utilisée par l'utilisateur (Arabe, Anglais ou Français).
+
+CONTEXTE DOCUMENTAIRE :
+"""
+
+MANUAL_QA_NOTE = "- NOTE : Le contexte contient une réponse provenant d'une FAQ manuelle officielle. Utilise cette réponse EXACTEMENT telle quelle sans la modifier.\n\n"
+NO_CONTEXT = "AUCUN DOCUMENT DISPONIBLE. Refuse de répondre poliment."
+CHUNK_SEPARATOR = "\n---\n"
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _overlap(left, right):
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    for size in range(min(MAX_OVERLAP, len(left), len(right)), MIN_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def strip_overlap(text, selected):
+    """Remove from `text` what the splitter's chunk_overlap already duplicated in a selected chunk."""
+    for other in selected:
+        if text in other:
+            return ""
+        head = _overlap(other, text)
+        if head:
+            text = text[head:]
+        tail = _overlap(text, other)
+        if tail:
+            text = text[:-tail]
+    return text.strip()
+
+def pack_chunks(chunks, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Keep chunks in rank order until the token budget is spent, after removing duplicated overlap.
+    The first chunk is truncated rather than dropped if it alone exceeds the budget.
+    Returns (packed_texts, used_tokens, kept_indices).
+    """
+    packed = []
+    kept = []
+    used = 0
+    separator_tokens = estimate_tokens(CHUNK_SEPARATOR)
+    for i, chunk in enumerate(chunks):
+        text = strip_overlap(chunk, packed)
+        if not text:
+            continue
+        cost = estimate_tokens(text) + (separator_tokens if packed else 0)
+        if used + cost > budget:
+            if not packed:
+                text = text[:int(budget * CHARS_PER_TOKEN)]
+                packed.append(text)
+                kept.append(i)
+                used = estimate_tokens(text)
+            continue
+        packed.append(text)
+        kept.append(i)
+        used += cost
+    return packed, used, kept
+
+def build_system_prompt(chunks, is_manual_hit=False, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Static instruction prefix followed by the per-turn part (FAQ note and packed context).
+    Returns (system_prompt, token_stats); token_stats["kept"] lists the indices of the chunks used.
+    """
+    packed, context_tokens, kept = pack_chunks(chunks, budget)
+    dynamic = (MANUAL_QA_NOTE if is_manual_hit else "") + (CHUNK_SEPARATOR.join(packed) if packed else NO_CONTEXT)
+    stats = {
+        "static_tokens": estimate_tokens(STATIC_SYSTEM_PROMPT),
+        "context_tokens": context_tokens,
+        "chunks_in": len(chunks),
+        "chunks_packed": len(packed),
+        "kept": kept,
+    }
+    return STATIC_SYSTEM_PROMPT + dynamic + "\n", stats
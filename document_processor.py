@@ -1,152 +1,448 @@
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 from docx import Document
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 import pandas as pd
 import camelot
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from extraction_cache import get_extraction_cache
 
-def extract_text_with_tables_from_pdf(pdf_path):
-    """Extraire le texte et les tables d'un fichier PDF."""
-    text = ""
+# Nombre de processus pour l'extraction (1 = extraction séquentielle)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "1"))
+# À incrémenter à chaque changement de la logique d'extraction : invalide le cache d'extraction
+EXTRACTOR_VERSION = 4
+# Processus Camelot par PDF (forcé à 1 dans les workers d'extract_files pour ne pas multiplier les pools)
+PDF_PAGE_WORKERS = int(os.getenv("PDF_PAGE_WORKERS", "4"))
+# Seuils de l'heuristique de détection de tables (en points PDF pour l'espacement)
+TABLE_MIN_RULES = 4
+TABLE_MIN_ROWS = 3
+TABLE_COLUMN_GAP = 15
+# Mots qui annoncent un tableau dans le texte (scans OCR sans traits ni colonnes nettes)
+TABLE_KEYWORDS = ("tableau", "barème", "bareme", "grille tarifaire")
+# Taille cible des chunks DOCX (paragraphes regroupés par section) et longueur max d'un titre en majuscules
+DOCX_CHUNK_SIZE = 1000
+SECTION_TITLE_MAX_LEN = 80
+
+def _is_rule(item):
+    """Trait horizontal ou vertical (bordure de cellule), ou rectangle."""
+    if item[0] == "re":
+        return True
+    if item[0] == "l":
+        p1, p2 = item[1], item[2]
+        return abs(p1.y - p2.y) < 1 or abs(p1.x - p2.x) < 1
+    return False
+
+def _visual_rows(page):
+    """Mots de la page regroupés en lignes visuelles (centres verticaux à moins d'une demi-hauteur)."""
+    rows = []
+    for x0, y0, x1, y1, *_ in sorted(page.get_text("words"), key=lambda w: w[1] + w[3]):
+        center = (y0 + y1) / 2
+        if rows and center - rows[-1][0] <= (y1 - y0) / 2:
+            rows[-1][1].append((x0, x1))
+        else:
+            rows.append((center, [(x0, x1)]))
+    return [words for _, words in rows]
+
+def page_may_have_table(page):
+    """
+    Heuristique PyMuPDF bon marché : la page contient des traits de tableau dessinés,
+    plusieurs lignes de texte découpées en colonnes (tables sans bordures, cas du mode stream,
+    y compris sur 2 colonnes), ou annonce un tableau dans son texte.
+    """
+    rules = 0
+    for drawing in page.get_drawings():
+        rules += sum(1 for item in drawing["items"] if _is_rule(item))
+        if rules >= TABLE_MIN_RULES:
+            return True
+
+    # Lignes découpées en colonnes aux grands espaces : 3 colonnes ou plus n'importe où sur la page,
+    # ou 2 colonnes sur des lignes consécutives (libellé / montant)
+    wide_rows = 0
+    consecutive = 0
+    for words in _visual_rows(page):
+        words.sort()
+        columns = 1 + sum(1 for (_, prev_x1), (x0, _) in zip(words, words[1:]) if x0 - prev_x1 > TABLE_COLUMN_GAP)
+        wide_rows += columns >= 3
+        consecutive = consecutive + 1 if columns >= 2 else 0
+        if wide_rows >= TABLE_MIN_ROWS or consecutive >= TABLE_MIN_ROWS:
+            return True
+
+    text = page.get_text().lower()
+    return any(keyword in text for keyword in TABLE_KEYWORDS)
+
+def _read_page_tables(pdf_path, page_number):
+    """Tables Camelot (markdown) d'une seule page."""
+    tables = camelot.read_pdf(pdf_path, pages=str(page_number), flavor='stream')
+    return [table.df.to_markdown(index=False) for table in tables]
+
+def _read_page_tables_safe(pdf_path, page_number):
+    """Comme _read_page_tables, mais renvoie (tables, erreur) : un échec de Camelot ne coûte que les tables de la page."""
     try:
-        # 1. Extraction du texte via PyMuPDF
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                text += page.get_text()
-        
-        # 2. Extraction des tables via Camelot
-        print(f"Extraction des tables pour {pdf_path}...")
-        tables = camelot.read_pdf(pdf_path, pages='all', flavor='stream')
-        if len(tables) > 0:
-            text += "\n\n### TABLES EXTRAITES DU DOCUMENT ###\n"
-            for i, table in enumerate(tables):
-                text += f"\n#### Table {i+1}\n"
-                text += table.df.to_markdown(index=False)
-                text += "\n"
+        return _read_page_tables(pdf_path, page_number), None
     except Exception as e:
-        print(f"Erreur lors de l'extraction (PDF) {pdf_path}: {e}")
-    return text
+        return [], f"{type(e).__name__}: {e}"
+
+def _extract_pdf_pages(pdf_path, with_tables=True, workers=None):
+    """
+    Texte PyMuPDF et tables Camelot (markdown) de chaque page : [{"page", "text", "tables"}].
+    Seules les erreurs du texte sont levées ; une page dont les tables ont échoué garde son texte
+    et porte l'erreur dans "table_error".
+    """
+    # 1. Texte via PyMuPDF, et repérage des pages susceptibles de contenir une table
+    pages = []
+    candidates = []
+    with fitz.open(pdf_path) as doc:
+        for page in doc:
+            pages.append({"page": page.number + 1, "text": page.get_text(), "tables": []})
+            if with_tables and page_may_have_table(page):
+                candidates.append(page.number + 1)
+
+    if not candidates:
+        return pages
+
+    # 2. Camelot uniquement sur les pages candidates, en parallèle
+    print(f"Extraction des tables pour {pdf_path} : {len(candidates)}/{len(pages)} pages candidates...")
+    if workers is None:
+        workers = PDF_PAGE_WORKERS
+    workers = min(workers, len(candidates))
+    try:
+        if workers <= 1:
+            results = [_read_page_tables_safe(pdf_path, n) for n in candidates]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_read_page_tables_safe, [pdf_path] * len(candidates), candidates))
+    except Exception as e:
+        # Pool cassé : aucune table, mais le texte de toutes les pages reste
+        results = [([], f"{type(e).__name__}: {e}")] * len(candidates)
+    for page_number, (tables, error) in zip(candidates, results):
+        pages[page_number - 1]["tables"] = tables
+        if error:
+            pages[page_number - 1]["table_error"] = error
+    return pages
+
+def _tables_complete(pages):
+    return not any(page.get("table_error") for page in pages)
 
-def process_docx_structured(docx_path):
-    """Extrait le contenu structuré d'un DOCX (sections et tables)."""
+def extract_pdf_pages(pdf_path, strict=False):
+    """
+    Extraction page par page d'un PDF, servie par le cache d'extraction si le fichier n'a pas changé.
+    Avec strict=True, seules les erreurs du texte (PyMuPDF) sont levées : un échec de Camelot est
+    signalé pour le fichier et ses pages gardent leur texte, sans être mises en cache.
+    """
     try:
-        doc = Document(docx_path)
-        content_items = []
-        current_section = "Général"
-        
-        # On parcourt les paragraphes et tables dans l'ordre du document
-        # Note: Cette approche simplifiée parcourt d'abord les paragraphes puis les tables.
-        # Pour une structure parfaite, il faudrait explorer les éléments XML.
-        
-        for para in doc.paragraphs:
-            # Détection de header (ex: XII. DEFINITION ou Heading 1)
-            style = para.style.name.lower()
-            text = para.text.strip()
-            
-            if not text:
+        pages = get_extraction_cache().get_or_extract(pdf_path, "pdf_pages", EXTRACTOR_VERSION, _extract_pdf_pages,
+                                                      cacheable=_tables_complete)
+    except Exception as e:
+        print(f"Erreur lors de l'extraction (PDF) {pdf_path}: {e}")
+        if strict:
+            raise
+        return []
+    failed = [page for page in pages if page.get("table_error")]
+    if failed:
+        print(f"Tables ignorées pour {os.path.basename(pdf_path)} (pages {', '.join(str(p['page']) for p in failed)}), "
+              f"texte conservé : {failed[0]['table_error']}")
+    return pages
+
+def extract_text_with_tables_from_pdf(pdf_path, strict=False):
+    """Extraire le texte et les tables d'un fichier PDF.
+    Avec strict=True, les erreurs sont propagées au lieu d'être seulement affichées."""
+    pages = extract_pdf_pages(pdf_path, strict=strict)
+    parts = [page["text"] for page in pages]
+    tables = [table for page in pages for table in page["tables"]]
+    if tables:
+        parts.append("\n\n### TABLES EXTRAITES DU DOCUMENT ###\n")
+        for i, table in enumerate(tables):
+            parts.append(f"\n#### Table {i+1}\n{table}\n")
+    return "".join(parts)
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Les zones de texte existent en double (mc:Choice en DrawingML, mc:Fallback en VML) : on ignore la copie de repli
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+ROMAN_PREFIXES = ("I.", "II.", "III.", "IV.", "V.", "VI.", "VII.", "VIII.", "IX.", "X.", "XI.", "XII.")
+
+def _paragraph_text(p):
+    """Texte propre d'un paragraphe, sans celui des zones de texte qui y sont ancrées."""
+    parts = []
+    def walk(element):
+        for child in element:
+            if child.tag in (W_NS + "txbxContent", MC_FALLBACK):
                 continue
-                
-            if "heading" in style or any(text.startswith(prefix) for prefix in ["I.", "II.", "III.", "IV.", "V.", "VI.", "VII.", "VIII.", "IX.", "X.", "XI.", "XII."]):
-                current_section = text
-            
+            if child.tag == W_NS + "t":
+                parts.append(child.text or "")
+            elif child.tag == W_NS + "tab":
+                parts.append("\t")
+            elif child.tag in (W_NS + "br", W_NS + "cr"):
+                parts.append("\n")
+            else:
+                walk(child)
+    walk(p)
+    return "".join(parts)
+
+def _text_boxes(element):
+    """Contenus des zones de texte ancrées dans un paragraphe (w:txbxContent), dans l'ordre."""
+    for child in element:
+        if child.tag == MC_FALLBACK:
+            continue
+        if child.tag == W_NS + "txbxContent":
+            yield child
+        else:
+            yield from _text_boxes(child)
+
+def _iter_blocks(container):
+    """Paragraphes et tables (w:p / w:tbl) dans l'ordre du document, zones de texte et contrôles de contenu compris."""
+    for child in container.iterchildren():
+        if child.tag == W_NS + "p":
+            yield "p", child
+            for box in _text_boxes(child):
+                yield from _iter_blocks(box)
+        elif child.tag == W_NS + "tbl":
+            yield "tbl", child
+        elif child.tag == W_NS + "sdt":
+            content = child.find(W_NS + "sdtContent")
+            if content is not None:
+                yield from _iter_blocks(content)
+
+def is_section_title(text, style):
+    """Titre de section : style Heading/Titre, numérotation romaine (ex: XII. DEFINITION) ou ligne courte en majuscules."""
+    style = style.lower()
+    if "heading" in style or "titre" in style or "title" in style:
+        return True
+    if text.startswith(ROMAN_PREFIXES):
+        return True
+    return len(text) <= SECTION_TITLE_MAX_LEN and text.isupper() and not text.endswith(".")
+
+def _process_docx_structured(docx_path, target_size=None):
+    """
+    Parcourt le corps XML du DOCX dans l'ordre et regroupe les paragraphes d'une même section
+    jusqu'à target_size caractères. Les tables restent à leur place, rattachées à leur section.
+    """
+    if target_size is None:
+        target_size = DOCX_CHUNK_SIZE
+    doc = Document(docx_path)
+    content_items = []
+    current_section = "Général"
+    buffer = []
+    # Le buffer ne contient-il que des titres ? (titres consécutifs regroupés avec le texte qui suit)
+    only_titles = True
+
+    def flush():
+        nonlocal only_titles
+        if buffer:
             content_items.append({
-                "content": text,
+                "content": "\n".join(buffer),
                 "metadata": {"section": current_section, "type": "text"}
             })
-            
-        for table in doc.tables:
+            buffer.clear()
+        only_titles = True
+
+    for kind, element in _iter_blocks(doc.element.body):
+        if kind == "tbl":
             data = []
-            for row in table.rows:
+            for row in Table(element, doc._body).rows:
                 data.append([cell.text.strip() for cell in row.cells])
-            
-            if data:
-                df = pd.DataFrame(data)
-                markdown_table = df.to_markdown(index=False)
+            if any(any(cell for cell in row) for row in data):
+                markdown_table = pd.DataFrame(data).to_markdown(index=False)
+                if buffer and only_titles:
+                    # Les titres qui précèdent directement la table l'introduisent
+                    markdown_table = "\n".join(buffer) + "\n" + markdown_table
+                    buffer.clear()
+                flush()
                 content_items.append({
                     "content": markdown_table,
                     "metadata": {"section": current_section, "type": "table"}
                 })
-                
-        return content_items
+            continue
+
+        text = _paragraph_text(element).strip()
+        if not text:
+            continue
+        if is_section_title(text, Paragraph(element, doc._body).style.name):
+            # Un titre ouvre un nouveau chunk, sauf s'il suit directement un autre titre
+            if not only_titles:
+                flush()
+            current_section = text.rstrip(" :\u00a0")
+        elif buffer and sum(len(t) + 1 for t in buffer) + len(text) > target_size:
+            flush()
+            only_titles = False
+        else:
+            only_titles = False
+        buffer.append(text)
+
+    flush()
+    return content_items
+
+def process_docx_structured(docx_path, strict=False):
+    """Extrait le contenu structuré d'un DOCX (blocs de texte et tables, avec leur section)."""
+    try:
+        return get_extraction_cache().get_or_extract(docx_path, "docx_items", EXTRACTOR_VERSION, _process_docx_structured)
     except Exception as e:
         print(f"Erreur lors de l'extraction (DOCX) {docx_path}: {e}")
+        if strict:
+            raise
         return []
 
-def process_documents(data_dir):
-    """
-    Parcourt le dossier data, extrait le texte/tables des fichiers PDF et DOCX,
-    et les découpe en morceaux (chunks) avec métadonnées enrichies.
-    """
-    documents = []
-    text_splitter = RecursiveCharacterTextSplitter(
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt", ".md")
+
+def get_text_splitter():
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=150,
         length_function=len,
     )
 
-    if not os.path.exists(data_dir):
-        print(f"Dossier {data_dir} inexistant.")
-        return []
+def process_file(file_path, text_splitter=None, strict=False):
+    """
+    Extrait et découpe un seul fichier en chunks.
+    Les IDs ne dépendent que du nom du fichier et de la position du chunk.
+    """
+    documents = []
+    if text_splitter is None:
+        text_splitter = get_text_splitter()
+    filename = os.path.basename(file_path)
 
-    for filename in os.listdir(data_dir):
-        file_path = os.path.join(data_dir, filename)
-        
-        if filename.endswith(".pdf"):
-            print(f"Traitement PDF : {filename}")
-            full_text = extract_text_with_tables_from_pdf(file_path)
-            chunks = text_splitter.split_text(full_text)
-            for i, chunk in enumerate(chunks):
+    if filename.endswith(".pdf"):
+        print(f"Traitement PDF : {filename}")
+        # Découpage page par page : chaque chunk connaît sa page, pour citer la source précisément
+        i = 0
+        for page in extract_pdf_pages(file_path, strict=strict):
+            pieces = [(chunk, "text") for chunk in text_splitter.split_text(page["text"])]
+            pieces += [(chunk, "table") for table in page["tables"] for chunk in text_splitter.split_text(table)]
+            for chunk, kind in pieces:
                 documents.append({
                     "content": chunk,
-                    "metadata": {"source": filename, "chunk_id": i, "type": "mixed", "section": "Multiple"},
+                    "metadata": {"source": filename, "chunk_id": i, "type": kind, "section": "Multiple", "page": page["page"]},
                     "id": f"{filename}_{i}"
                 })
-                
-        elif filename.endswith(".docx"):
-            print(f"Traitement DOCX : {filename}")
-            items = process_docx_structured(file_path)
-            for i, item in enumerate(items):
-                # On rescinde les items textuels trop longs
-                if len(item["content"]) > 1000:
-                    sub_chunks = text_splitter.split_text(item["content"])
-                    for j, sc in enumerate(sub_chunks):
-                        meta = item["metadata"].copy()
-                        meta.update({"source": filename, "chunk_id": f"{i}_{j}"})
-                        documents.append({
-                            "content": sc,
-                            "metadata": meta,
-                            "id": f"{filename}_{i}_{j}"
-                        })
-                else:
+                i += 1
+
+    elif filename.endswith(".docx"):
+        print(f"Traitement DOCX : {filename}")
+        items = process_docx_structured(file_path, strict=strict)
+        for i, item in enumerate(items):
+            # On rescinde les items textuels trop longs
+            if len(item["content"]) > 1000:
+                sub_chunks = text_splitter.split_text(item["content"])
+                for j, sc in enumerate(sub_chunks):
                     meta = item["metadata"].copy()
-                    meta.update({"source": filename, "chunk_id": i})
+                    meta.update({"source": filename, "chunk_id": f"{i}_{j}"})
                     documents.append({
-                        "content": item["content"],
+                        "content": sc,
                         "metadata": meta,
-                        "id": f"{filename}_{i}"
-                    })
-        elif filename.endswith((".txt", ".md")):
-            print(f"Traitement Texte/Markdown : {filename}")
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    full_text = f.read()
-                chunks = text_splitter.split_text(full_text)
-                for i, chunk in enumerate(chunks):
-                    documents.append({
-                        "content": chunk,
-                        "metadata": {"source": filename, "chunk_id": i, "type": "text", "section": "Général"},
-                        "id": f"{filename}_{i}"
+                        "id": f"{filename}_{i}_{j}"
                     })
-            except Exception as e:
-                print(f"Erreur lors de la lecture de {filename}: {e}")
-        else:
-            print(f"Ignoré : {filename}")
-            
+            else:
+                meta = item["metadata"].copy()
+                meta.update({"source": filename, "chunk_id": i})
+                documents.append({
+                    "content": item["content"],
+                    "metadata": meta,
+                    "id": f"{filename}_{i}"
+                })
+    elif filename.endswith((".txt", ".md")):
+        print(f"Traitement Texte/Markdown : {filename}")
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                full_text = f.read()
+            chunks = text_splitter.split_text(full_text)
+            for i, chunk in enumerate(chunks):
+                documents.append({
+                    "content": chunk,
+                    "metadata": {"source": filename, "chunk_id": i, "type": "text", "section": "Général"},
+                    "id": f"{filename}_{i}"
+                })
+        except Exception as e:
+            print(f"Erreur lors de la lecture de {filename}: {e}")
+            if strict:
+                raise
+    else:
+        print(f"Ignoré : {filename}")
+
     return documents
 
+def _extract_one(file_path):
+    """Point d'entrée d'un worker : ne lève jamais, renvoie l'erreur éventuelle."""
+    try:
+        return file_path, process_file(file_path, strict=True), None
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}"
+
+def _init_extract_worker():
+    global PDF_PAGE_WORKERS
+    PDF_PAGE_WORKERS = 1
+
+def extract_files(file_paths, workers=None):
+    """
+    Extrait une liste de fichiers, séquentiellement ou dans un pool de processus.
+    Génère des tuples (file_path, documents, erreur) dans l'ordre de file_paths,
+    ce qui garde les IDs et l'ordre des chunks déterministes quel que soit le nombre de workers.
+    """
+    if workers is None:
+        workers = EXTRACT_WORKERS
+    workers = min(workers, len(file_paths))
+
+    if workers <= 1:
+        for file_path in file_paths:
+            yield _extract_one(file_path)
+        return
+
+    print(f"Extraction parallèle de {len(file_paths)} fichiers sur {workers} processus...")
+    paths = iter(file_paths)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker) as executor:
+        # Fenêtre bornée de fichiers en vol : la mémoire ne dépend pas de la taille du corpus
+        pending = deque(executor.submit(_extract_one, path) for _, path in zip(range(workers * 2), paths))
+        while pending:
+            result = pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(executor.submit(_extract_one, next_path))
+            yield result
+
+def list_data_files(data_dir):
+    """Fichiers supportés du dossier, triés pour un ordre de traitement stable."""
+    return [
+        os.path.join(data_dir, filename)
+        for filename in sorted(os.listdir(data_dir))
+        if filename.endswith(SUPPORTED_EXTENSIONS)
+    ]
+
+def iter_documents(data_dir, workers=None, errors=None):
+    """
+    Version générateur de process_documents : les chunks sont produits fichier par fichier,
+    sans jamais matérialiser tout le corpus en mémoire.
+    Si une liste `errors` est fournie, elle reçoit les couples (fichier, erreur).
+    """
+    if not os.path.exists(data_dir):
+        print(f"Dossier {data_dir} inexistant.")
+        return
+
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(SUPPORTED_EXTENSIONS):
+            print(f"Ignoré : {filename}")
+
+    for file_path, docs, error in extract_files(list_data_files(data_dir), workers):
+        if error:
+            print(f"Échec de l'extraction de {os.path.basename(file_path)} : {error}")
+            if errors is not None:
+                errors.append((os.path.basename(file_path), error))
+            continue
+        yield from docs
+
+def process_documents(data_dir, workers=None, errors=None):
+    """
+    Parcourt le dossier data, extrait le texte/tables des fichiers PDF et DOCX,
+    et les découpe en morceaux (chunks) avec métadonnées enrichies.
+    """
+    return list(iter_documents(data_dir, workers, errors))
+
 if __name__ == "__main__":
     data_directory = "data"
-    docs = process_documents(data_directory)
+    errors = []
+    docs = process_documents(data_directory, errors=errors)
     print(f"Nombre total de chunks extraits: {len(docs)}")
     if docs:
         print(f"Exemple de métadonnées: {docs[0]['metadata']}")
+    if errors:
+        print(f"Fichiers en erreur: {[name for name, _ in errors]}")
@@ -0,0 +1,177 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+import numpy as np
+from metrics import record_cold_start
+
+# Configuration
+DB_PATH = os.getenv("DB_PATH", "chroma_db")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(DB_PATH, "embedding_cache.sqlite3"))
+# "torch" (sentence-transformers) or "onnx" (ONNX Runtime, see onnx_embedder.py export/parity)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+
+# Vectors are computed here and handed to Chroma explicitly, so collections are opened
+# without a Chroma embedding function. The distance space must then be set by hand.
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
+
+class EmbeddingService:
+    """
+    Single entry point for sentence embeddings, shared by ingestion, the app and the scripts.
+    Texts are encoded in explicit batches and every vector is cached on disk,
+    keyed by (model name, sha256 of the text), so a text is never encoded twice.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=EMBEDDING_BATCH_SIZE,
+                 cache_path=EMBEDDING_CACHE_PATH, device="cpu", backend=EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_path = cache_path
+        self.device = device
+        self.backend = backend
+        # Vectors from another backend are close but not identical: they are cached separately
+        self.cache_namespace = model_name if backend == "torch" else f"{model_name}@{backend}"
+        self._model = None
+        self._lock = threading.Lock()
+        # Separate lock: loading the model can take seconds and must not block cache lookups
+        self._load_lock = threading.Lock()
+        self._db = None
+        self.metrics = {"cache_hits": 0, "cache_misses": 0, "encoded": 0, "encode_seconds": 0.0}
+
+        if cache_path:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(cache_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._db.commit()
+
+    @property
+    def model(self):
+        with self._load_lock:
+            if self._model is None:
+                print(f"Loading embedding model: {self.model_name} ({self.backend})")
+                started = time.perf_counter()
+                if self.backend == "onnx":
+                    from onnx_embedder import OnnxEmbedder
+                    self._model = OnnxEmbedder()
+                else:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+                record_cold_start("embedding_model", time.perf_counter() - started)
+        return self._model
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, hashes):
+        if self._db is None or not hashes:
+            return {}
+        found = {}
+        # Stay well under SQLite's bound-parameter limit
+        for start in range(0, len(hashes), 500):
+            part = hashes[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            rows = self._db.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.cache_namespace] + part
+            ).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _cache_put(self, items):
+        if self._db is None or not items:
+            return
+        self._db.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+            [(self.cache_namespace, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+             for text_hash, vector in items]
+        )
+        self._db.commit()
+
+    def encode(self, texts):
+        """Encode texts with the model, bypassing the cache."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            started = time.perf_counter()
+            encoded = self.model.encode(batch, batch_size=self.batch_size, convert_to_numpy=True)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.metrics["encoded"] += len(batch)
+                self.metrics["encode_seconds"] += elapsed
+            vectors.extend(np.asarray(v, dtype=np.float32).tolist() for v in encoded)
+        return vectors
+
+    def embed(self, texts):
+        """Return one embedding (list of floats) per text, encoding only cache misses."""
+        texts = list(texts)
+        if not texts:
+            return []
+        hashes = [self.text_hash(t) for t in texts]
+        with self._lock:
+            cached = self._cache_get(list(set(hashes)))
+
+        # Deduplicate misses so repeated texts inside one call are encoded once
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in cached and text_hash not in missing:
+                missing[text_hash] = text
+
+        with self._lock:
+            self.metrics["cache_hits"] += len(texts) - sum(1 for h in hashes if h in missing)
+            self.metrics["cache_misses"] += len(missing)
+
+        if missing:
+            vectors = self.encode(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            with self._lock:
+                self._cache_put(new_items)
+            cached.update(new_items)
+
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text):
+        return self.embed([text])[0]
+
+    def stats(self):
+        """Counters plus encoding throughput in sentences per second."""
+        with self._lock:
+            stats = dict(self.metrics)
+        seconds = stats["encode_seconds"]
+        stats["sentences_per_second"] = round(stats["encoded"] / seconds, 1) if seconds > 0 else None
+        return stats
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_embedding_service():
+    """Process-wide shared instance."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = EmbeddingService()
+    return _service
+
+def get_collection(client, name, create=False):
+    """Open a collection that receives embeddings computed by the EmbeddingService."""
+    if create:
+        return client.get_or_create_collection(name=name, embedding_function=None, metadata=COLLECTION_METADATA)
+    return client.get_collection(name=name, embedding_function=None)
+
+if __name__ == "__main__":
+    # Quick throughput check on the current node
+    service = EmbeddingService(cache_path=None)
+    sample = ["Quels sont les frais de la carte Mastercard ?"] * 256
+    service.embed_query("warm-up")
+    service.metrics.update({"encoded": 0, "encode_seconds": 0.0})
+    service.encode(sample)
+    print(f"Throughput: {service.stats()['sentences_per_second']} sentences/s "
+          f"(model={service.model_name}, backend={service.backend}, batch_size={service.batch_size})")
@@ -0,0 +1,73 @@
+import os
+import json
+import hashlib
+import threading
+
+# Configuration
+DB_PATH = os.getenv("DB_PATH", "chroma_db")
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(DB_PATH, "extraction_cache"))
+EXTRACTION_CACHE = os.getenv("EXTRACTION_CACHE", "1") == "1"
+
+def file_sha256(path):
+    """Hash the raw bytes of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+class ExtractionCache:
+    """
+    Content-addressed on-disk cache of extraction results (JSON), keyed by the file's sha256,
+    the kind of extraction and the extractor version. Renaming a file keeps its entry;
+    editing it or bumping the version makes a new one.
+    """
+
+    def __init__(self, cache_dir=EXTRACTION_CACHE_DIR, enabled=EXTRACTION_CACHE):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+
+    def _path(self, file_hash, kind, version):
+        return os.path.join(self.cache_dir, file_hash[:2], f"{file_hash}.{kind}.v{version}.json")
+
+    def get(self, file_hash, kind, version):
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(file_hash, kind, version), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, file_hash, kind, version, value):
+        if not self.enabled:
+            return
+        path = self._path(file_hash, kind, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp name: several extraction processes may write at the same time
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get_or_extract(self, file_path, kind, version, extract, cacheable=None):
+        """
+        Return the cached result for `file_path`, or run `extract(file_path)` and store it
+        (only when `cacheable(result)` is true, if given: partial results are retried next time).
+        """
+        if not self.enabled:
+            return extract(file_path)
+        file_hash = file_sha256(file_path)
+        cached = self.get(file_hash, kind, version)
+        if cached is not None:
+            print(f"Cache d'extraction utilisé pour {os.path.basename(file_path)}")
+            return cached
+        value = extract(file_path)
+        if cacheable is None or cacheable(value):
+            self.put(file_hash, kind, version, value)
+        return value
+
+_cache = ExtractionCache()
+
+def get_extraction_cache():
+    return _cache
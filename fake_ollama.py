@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from datetime import datetime, timezone
+from aiohttp import web
+
+# Configuration
+FAKE_OLLAMA_HOST = os.getenv("FAKE_OLLAMA_HOST", "0.0.0.0")
+FAKE_OLLAMA_PORT = int(os.getenv("FAKE_OLLAMA_PORT", "11435"))
+# Decoding speed of one stream, and tokens per answer
+FAKE_TOKENS_PER_SECOND = float(os.getenv("FAKE_TOKENS_PER_SECOND", "30"))
+FAKE_ANSWER_TOKENS = int(os.getenv("FAKE_ANSWER_TOKENS", "120"))
+# Prompt evaluation time before the first token, per 1000 prompt tokens
+FAKE_PREFILL_MS = float(os.getenv("FAKE_PREFILL_MS", "300"))
+# Like OLLAMA_NUM_PARALLEL: generations beyond this number wait for a free slot
+FAKE_NUM_PARALLEL = int(os.getenv("FAKE_NUM_PARALLEL", "4"))
+# Per-stream slowdown for each other generation running at the same time (shared GPU)
+FAKE_BATCH_SLOWDOWN = float(os.getenv("FAKE_BATCH_SLOWDOWN", "0.15"))
+FAKE_MODELS = [m.strip() for m in os.getenv("FAKE_MODELS", "qwen2.5:1.5b,qwen2.5:7b").split(",") if m.strip()]
+
+ANSWER_WORDS = (
+    "Selon la documentation de la BNM, cette opération peut être effectuée en agence ou depuis "
+    "l'application mobile. Les frais et plafonds dépendent du type de compte et de la carte utilisée. "
+    "Pour plus de détails, veuillez contacter votre conseiller ou le service client."
+).split()
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+def _prompt_tokens(text):
+    # About four characters per token, as a rough stand-in for the real tokenizer
+    return max(1, len(text) // 4)
+
+class FakeOllama:
+    """
+    Offline stand-in for the Ollama API used by the chatbot (/api/chat, /api/generate, /api/tags).
+    Answers are canned text streamed at a fixed token rate; at most `num_parallel` generations run
+    at once and each one slows down as more run together, so the chat server can be saturated.
+    """
+
+    def __init__(self, tokens_per_second=FAKE_TOKENS_PER_SECOND, answer_tokens=FAKE_ANSWER_TOKENS,
+                 prefill_ms=FAKE_PREFILL_MS, num_parallel=FAKE_NUM_PARALLEL,
+                 batch_slowdown=FAKE_BATCH_SLOWDOWN, models=FAKE_MODELS):
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.prefill_ms = prefill_ms
+        self.batch_slowdown = batch_slowdown
+        self.models = models
+        self.slots = asyncio.Semaphore(num_parallel)
+        self.active = 0
+        self.served = 0
+
+    def _token_delay(self):
+        return (1 + self.batch_slowdown * max(0, self.active - 1)) / self.tokens_per_second
+
+    async def _generate(self, prompt_tokens, num_predict=None):
+        """Yield the answer token by token, holding one parallel slot for the whole generation."""
+        count = min(self.answer_tokens, num_predict) if num_predict and num_predict > 0 else self.answer_tokens
+        async with self.slots:
+            self.active += 1
+            try:
+                await asyncio.sleep(prompt_tokens * self.prefill_ms / 1e6)
+                offset = random.randrange(len(ANSWER_WORDS))
+                for i in range(count):
+                    await asyncio.sleep(self._token_delay())
+                    word = ANSWER_WORDS[(offset + i) % len(ANSWER_WORDS)]
+                    yield word if i == 0 else " " + word
+            finally:
+                self.active -= 1
+                self.served += 1
+
+    def _final(self, model, prompt_tokens, eval_count, started):
+        return {
+            "model": model,
+            "created_at": _now(),
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": eval_count,
+        }
+
+    async def _respond(self, request, body, prompt_tokens, wrap):
+        """Stream NDJSON chunks, or return a single JSON object when "stream" is false."""
+        model = body.get("model", "")
+        num_predict = (body.get("options") or {}).get("num_predict")
+        started = time.perf_counter()
+        if body.get("stream", True) is False:
+            parts = [piece async for piece in self._generate(prompt_tokens, num_predict)]
+            final = self._final(model, prompt_tokens, len(parts), started)
+            final.update(wrap("".join(parts)))
+            return web.json_response(final)
+
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        eval_count = 0
+        async for piece in self._generate(prompt_tokens, num_predict):
+            eval_count += 1
+            chunk = {"model": model, "created_at": _now(), "done": False}
+            chunk.update(wrap(piece))
+            await response.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+        final = self._final(model, prompt_tokens, eval_count, started)
+        final.update(wrap(""))
+        await response.write((json.dumps(final) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    async def handle_chat(self, request):
+        body = await request.json()
+        prompt = "".join(m.get("content", "") for m in body.get("messages", []))
+        return await self._respond(request, body, _prompt_tokens(prompt),
+                                   lambda text: {"message": {"role": "assistant", "content": text}})
+
+    async def handle_generate(self, request):
+        body = await request.json()
+        if not body.get("prompt"):
+            # Empty prompt: Ollama only loads the model (used by the warm-up)
+            return web.json_response({"model": body.get("model", ""), "created_at": _now(),
+                                      "response": "", "done": True, "done_reason": "load"})
+        return await self._respond(request, body, _prompt_tokens(body["prompt"]),
+                                   lambda text: {"response": text})
+
+    async def handle_tags(self, request):
+        return web.json_response({"models": [{"name": m, "model": m, "modified_at": _now(), "size": 0}
+                                             for m in self.models]})
+
+    async def handle_version(self, request):
+        return web.json_response({"version": "0.0.0-fake"})
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post("/api/chat", self.handle_chat)
+        app.router.add_post("/api/generate", self.handle_generate)
+        app.router.add_get("/api/tags", self.handle_tags)
+        app.router.add_get("/api/version", self.handle_version)
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux serveur Ollama (réponses générées à débit fixe) pour les tests de charge hors ligne.")
+    parser.add_argument("--port", type=int, default=FAKE_OLLAMA_PORT)
+    parser.add_argument("--tokens-per-second", type=float, default=FAKE_TOKENS_PER_SECOND, help="Débit d'un flux")
+    parser.add_argument("--answer-tokens", type=int, default=FAKE_ANSWER_TOKENS, help="Tokens par réponse")
+    parser.add_argument("--prefill-ms", type=float, default=FAKE_PREFILL_MS, help="Délai avant le 1er token, par 1000 tokens de prompt")
+    parser.add_argument("--num-parallel", type=int, default=FAKE_NUM_PARALLEL, help="Générations simultanées (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--batch-slowdown", type=float, default=FAKE_BATCH_SLOWDOWN,
+                        help="Ralentissement d'un flux par génération concurrente")
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.tokens_per_second, args.answer_tokens, args.prefill_ms,
+                      args.num_parallel, args.batch_slowdown)
+    print(f"Fake Ollama: {args.tokens_per_second} tok/s per stream, {args.answer_tokens} tokens per answer, "
+          f"{args.num_parallel} parallel slots")
+    web.run_app(fake.create_app(), host=FAKE_OLLAMA_HOST, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import json
+import numpy as np
+from rag_cache import normalize_query
+
+# Configuration
+MANUAL_QA_PATH = os.getenv("MANUAL_QA_PATH", "manual_qa.json")
+# Cosine similarity above which a stored FAQ answer is returned as-is, without the LLM
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.92"))
+
+class FAQIndex:
+    """
+    In-memory index of manual_qa.json: normalized question text for exact matches
+    and a normalized embedding matrix for near-duplicate questions.
+    """
+
+    def __init__(self, qa_pairs, embedding_service, threshold=FAQ_MATCH_THRESHOLD):
+        self.threshold = threshold
+        self.questions = []
+        self.answers = []
+        self.exact = {}
+        for qa in qa_pairs:
+            q = qa.get("question", "")
+            a = qa.get("answer", "")
+            if q and a:
+                self.exact.setdefault(normalize_query(q), len(self.answers))
+                self.questions.append(q)
+                self.answers.append(a)
+
+        self.matrix = None
+        if self.questions:
+            matrix = np.asarray(embedding_service.embed(self.questions), dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self.matrix = matrix / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def load(cls, embedding_service, path=MANUAL_QA_PATH, threshold=FAQ_MATCH_THRESHOLD):
+        qa_pairs = []
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    qa_pairs = json.load(f)
+            except Exception as e:
+                print(f"Error loading {path}: {e}")
+        return cls(qa_pairs, embedding_service, threshold)
+
+    def match(self, query, query_embedding=None):
+        """
+        Return {"question", "answer", "score"} for the best FAQ entry if it passes the threshold,
+        otherwise None. An exact match on the normalized text never needs the embedding.
+        """
+        if not self.answers:
+            return None
+
+        i = self.exact.get(normalize_query(query))
+        if i is not None:
+            return {"question": self.questions[i], "answer": self.answers[i], "score": 1.0}
+
+        if query_embedding is None:
+            return None
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        scores = self.matrix @ vector
+        i = int(np.argmax(scores))
+        if scores[i] >= self.threshold:
+            return {"question": self.questions[i], "answer": self.answers[i], "score": float(scores[i])}
+        return None
+
+def stream_answer(answer):
+    """Yield a stored answer word by word so the UI can render it like a generation."""
+    words = answer.split(" ")
+    for i, word in enumerate(words):
+        yield word if i == len(words) - 1 else word + " "
@@ -1,20 +1,26 @@
 import os
 import json
+import time
+import asyncio
+import hashlib
 import ollama
-from document_processor import process_documents
+from document_processor import iter_documents
 
 # Configuration
 DATA_DIR = "data"
 MANUAL_QA_FILE = "manual_qa.json"
 OUTPUT_FILE = "bnm_dataset.jsonl"
+# Hashes of the chunks already handled, so an interrupted run can resume (delete both files to start over)
+PROGRESS_FILE = "bnm_dataset.progress"
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 MODEL = "qwen2.5:7b" 
+# Number of generations sent to Ollama at the same time
+CONCURRENCY = int(os.getenv("GEN_CONCURRENCY", "4"))
+SYSTEM_MESSAGE = "Tu es l'Assistant Expert de la Banque Nationale de Mauritanie (BNM)."
 
-client = ollama.Client(host=OLLAMA_HOST)
-
-def generate_qa_pair(chunk_content):
-    """Génère une question et une réponse avec un prompt renforcé."""
-    prompt = f"""Tu es un expert en données pour la Banque Nationale de Mauritanie (BNM).
+def build_qa_prompt(chunk_content):
+    """Prompt renforcé de génération d'une paire question/réponse."""
+    return f"""Tu es un expert en données pour la Banque Nationale de Mauritanie (BNM).
 À partir du texte suivant, génère une paire Question/Réponse pertinente.
 
 DIRECTIVES :
@@ -28,20 +34,83 @@ TEXTE :
 
 Formate ta réponse en JSON valide : {{"question": "...", "answer": "..."}}
 JSON :"""
-    
+
+def parse_qa(raw_text):
+    start = raw_text.find('{')
+    end = raw_text.rfind('}') + 1
+    if start != -1 and end > 0:
+        qa = json.loads(raw_text[start:end])
+        if qa.get("question") and qa.get("answer"):
+            return qa
+    return None
+
+async def generate_qa_pair(client, chunk_content):
+    """Génère une question et une réponse avec un prompt renforcé."""
     try:
-        response = client.generate(model=MODEL, prompt=prompt)
-        raw_text = response['response']
-        start = raw_text.find('{')
-        end = raw_text.rfind('}') + 1
-        if start != -1 and end != -1:
-            return json.loads(raw_text[start:end])
+        response = await client.generate(model=MODEL, prompt=build_qa_prompt(chunk_content))
+        return parse_qa(response['response'])
     except Exception as e:
         print(f"Erreur QA: {e}")
     return None
 
-def prepare_dataset():
-    dataset = []
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def to_example(question, answer):
+    return {
+        "messages": [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer}
+        ]
+    }
+
+def load_progress():
+    if not os.path.exists(PROGRESS_FILE):
+        return set()
+    with open(PROGRESS_FILE, "r", encoding="utf-8") as f:
+        return set(line.strip() for line in f if line.strip())
+
+class DatasetWriter:
+    """Append-as-you-go JSONL output plus the matching progress checkpoint."""
+
+    def __init__(self):
+        self.done = load_progress()
+        self.output = open(OUTPUT_FILE, "a", encoding="utf-8")
+        self.progress = open(PROGRESS_FILE, "a", encoding="utf-8")
+        self.written = 0
+
+    def write(self, key, example=None):
+        # The example is flushed before its hash, so a crash never marks an unsaved chunk as done
+        if example is not None:
+            self.output.write(json.dumps(example, ensure_ascii=False) + "\n")
+            self.output.flush()
+            self.written += 1
+        self.progress.write(key + "\n")
+        self.progress.flush()
+        self.done.add(key)
+
+    def close(self):
+        self.output.close()
+        self.progress.close()
+
+def produce_chunks(loop, queue, skip):
+    """Runs in a thread: streams chunks from the documents into the asyncio queue."""
+    try:
+        for chunk in iter_documents(DATA_DIR):
+            key = content_hash(chunk["content"])
+            if key in skip:
+                continue
+            skip.add(key)
+            asyncio.run_coroutine_threadsafe(queue.put((key, chunk)), loop).result()
+    finally:
+        for _ in range(CONCURRENCY):
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+async def prepare_dataset():
+    writer = DatasetWriter()
+    if writer.done:
+        print(f"Reprise : {len(writer.done)} éléments déjà traités seront ignorés.")
 
     # 1. Charger les QA manuelles si elles existent
     if os.path.exists(MANUAL_QA_FILE):
@@ -49,43 +118,52 @@ def prepare_dataset():
         try:
             with open(MANUAL_QA_FILE, "r", encoding="utf-8") as f:
                 manual_data = json.load(f)
-                for qa in manual_data:
-                    dataset.append({
-                        "messages": [
-                            {"role": "system", "content": "Tu es l'Assistant Expert de la Banque Nationale de Mauritanie (BNM)."},
-                            {"role": "user", "content": qa["question"]},
-                            {"role": "assistant", "content": qa["answer"]}
-                        ]
-                    })
-            print(f"{len(manual_data)} QA manuelles ajoutées.")
+            added = 0
+            for qa in manual_data:
+                key = content_hash("manual:" + qa["question"] + "\n" + qa["answer"])
+                if key not in writer.done:
+                    writer.write(key, to_example(qa["question"], qa["answer"]))
+                    added += 1
+            print(f"{added} QA manuelles ajoutées.")
         except Exception as e:
             print(f"Erreur lors du chargement des QA manuelles: {e}")
 
-    # 2. Générer des données synthétiques à partir des documents
-    print("Extraction des documents...")
-    chunks = process_documents(DATA_DIR)
-    print(f"Génération pour {len(chunks)} morceaux...")
-    
-    for i, chunk in enumerate(chunks):
-        qa = generate_qa_pair(chunk["content"])
-        if qa:
-            dataset.append({
-                "messages": [
-                    {"role": "system", "content": "Tu es l'Assistant Expert de la Banque Nationale de Mauritanie (BNM)."},
-                    {"role": "user", "content": qa["question"]},
-                    {"role": "assistant", "content": qa["answer"]}
-                ]
-            })
-            print(f"[{i+1}/{len(chunks)}] QA générée: {qa['question'][:50]}...")
-
-    # 3. Sauvegarder
-    if dataset:
-        with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-            for entry in dataset:
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-        print(f"Terminé : {OUTPUT_FILE} contient {len(dataset)} exemples.")
+    # 2. Générer des données synthétiques à partir des documents, CONCURRENCY requêtes à la fois
+    print(f"Extraction des documents et génération ({CONCURRENCY} requêtes simultanées)...")
+    client = ollama.AsyncClient(host=OLLAMA_HOST)
+    queue = asyncio.Queue(maxsize=CONCURRENCY * 2)
+    loop = asyncio.get_running_loop()
+    producer = loop.run_in_executor(None, produce_chunks, loop, queue, set(writer.done))
+    stats = {"generated": 0, "failed": 0}
+    started = time.perf_counter()
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            key, chunk = item
+            qa = await generate_qa_pair(client, chunk["content"])
+            if qa:
+                writer.write(key, to_example(qa["question"], qa["answer"]))
+                stats["generated"] += 1
+                elapsed = time.perf_counter() - started
+                print(f"[{stats['generated']}] QA générée ({stats['generated'] / elapsed * 60:.1f}/min): {qa['question'][:50]}...")
+            else:
+                # Not checkpointed: the chunk is retried on the next run
+                stats["failed"] += 1
+
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    await producer
+    elapsed = time.perf_counter() - started
+    writer.close()
+
+    # 3. Bilan
+    if writer.written or writer.done:
+        print(f"Terminé : {stats['generated']} QA générées, {stats['failed']} échecs en {elapsed:.0f}s "
+              f"({stats['generated'] / max(elapsed, 1e-9) * 60:.1f} QA/min). {OUTPUT_FILE} complété de {writer.written} exemples.")
     else:
         print("Aucune donnée disponible.")
 
 if __name__ == "__main__":
-    prepare_dataset()
+    asyncio.run(prepare_dataset())
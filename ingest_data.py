@@ -1,73 +1,216 @@
 import chromadb
-from chromadb.utils import embedding_functions
 import os
 import json
-from document_processor import process_documents
+import hashlib
+from document_processor import extract_files, list_data_files, EXTRACTOR_VERSION
+from extraction_cache import file_sha256
+from embedding_service import get_embedding_service, get_collection
+from rag_cache import bump_collection_version
+from bm25_index import BM25Index, BM25_INDEX_PATH
 
 # Configuration
 DATA_DIR = os.getenv("DATA_DIR", "data")
 DB_PATH = os.getenv("DB_PATH", "chroma_db")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "bnm_qa")
+MANUAL_QA_PATH = "manual_qa.json"
+MANIFEST_PATH = os.path.join(DB_PATH, "ingest_manifest.json")
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "256"))
+
+# Bump this when the chunking logic changes so that every file is re-processed
+# (extraction changes are tracked by document_processor.EXTRACTOR_VERSION)
+MANIFEST_VERSION = 1
+
+def chunk_hash(doc):
+    """Hash the content and metadata of a chunk, so that any change triggers a re-embedding."""
+    payload = json.dumps([doc["content"], doc["metadata"]], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_manifest():
+    if os.path.exists(MANIFEST_PATH):
+        try:
+            with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION and manifest.get("extractor_version") == EXTRACTOR_VERSION:
+                return manifest
+            print("Manifest or extractor version changed, re-processing every file.")
+            # Keep the chunk IDs already in Chroma so that chunks the new extraction no longer
+            # produces are still deleted; a cleared hash forces the file to be re-extracted
+            fresh = new_manifest()
+            for name, entry in manifest.get("files", {}).items():
+                fresh["files"][name] = {"hash": None, "chunks": entry.get("chunks", {})}
+            return fresh
+        except Exception as e:
+            print(f"Error reading {MANIFEST_PATH}, re-processing every file: {e}")
+    return new_manifest()
+
+def new_manifest():
+    return {"version": MANIFEST_VERSION, "extractor_version": EXTRACTOR_VERSION, "files": {}}
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_PATH) or ".", exist_ok=True)
+    tmp_path = MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def load_manual_qa(json_path):
+    """Convert the manual QA JSON into chunks with the same shape as process_file()."""
+    documents = []
+    print(f"Loading manual QA from: {json_path}")
+    try:
+        with open(json_path, "r", encoding="utf-8") as f:
+            manual_qa = json.load(f)
+        for i, qa in enumerate(manual_qa):
+            q = qa.get("question", "")
+            a = qa.get("answer", "")
+            if q and a:
+                documents.append({
+                    "content": f"Question: {q}\n\nRéponse: {a}",
+                    "metadata": {"source": "manual_qa.json", "type": "qa", "qa_id": i},
+                    "id": f"manual_qa_{i}"
+                })
+        print(f"Added {len(documents)} QA pairs from JSON.")
+    except Exception as e:
+        print(f"Error loading {json_path}: {e}")
+    return documents
+
+def list_sources():
+    """Map every ingestable source name to its path on disk."""
+    sources = {os.path.basename(path): path for path in list_data_files(DATA_DIR)}
+    if os.path.exists(MANUAL_QA_PATH):
+        sources["manual_qa.json"] = MANUAL_QA_PATH
+    return sources
 
 def ingest():
     print(f"Scanning directory: {DATA_DIR}")
-    
+
     if not os.path.exists(DATA_DIR):
         print(f"Error: Directory {DATA_DIR} not found.")
         return
 
-    # Process documents into chunks
-    processed_docs = process_documents(DATA_DIR)
-    
-    documents = [doc["content"] for doc in processed_docs]
-    metadatas = [doc["metadata"] for doc in processed_docs]
-    ids = [doc["id"] for doc in processed_docs]
-
-    # Process manual QA from JSON if exists
-    JSON_PATH = "manual_qa.json"
-    if os.path.exists(JSON_PATH):
-        print(f"Loading manual QA from: {JSON_PATH}")
-        try:
-            with open(JSON_PATH, "r", encoding="utf-8") as f:
-                manual_qa = json.load(f)
-                for i, qa in enumerate(manual_qa):
-                    q = qa.get("question", "")
-                    a = qa.get("answer", "")
-                    if q and a:
-                        content = f"Question: {q}\n\nRéponse: {a}"
-                        documents.append(content)
-                        metadatas.append({"source": "manual_qa.json", "type": "qa", "qa_id": i})
-                        ids.append(f"manual_qa_{i}")
-            print(f"Added {len(manual_qa)} QA pairs from JSON.")
-        except Exception as e:
-            print(f"Error loading {JSON_PATH}: {e}")
-
-    if not documents:
+    sources = list_sources()
+    if not sources:
         print("No documents found to ingest.")
         return
 
     try:
         # Initialize ChromaDB
         client = chromadb.PersistentClient(path=DB_PATH)
-        embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name="paraphrase-multilingual-MiniLM-L12-v2"
-        )
-        
-        # Reset or update collection
-        # Note: If you want to start fresh, you can use client.delete_collection(COLLECTION_NAME) beforehand
-        collection = client.get_or_create_collection(
-            name=COLLECTION_NAME,
-            embedding_function=embedding_function
-        )
+        embedding_service = get_embedding_service()
+        collection = get_collection(client, COLLECTION_NAME, create=True)
+
+        manifest = load_manifest()
+        if manifest["files"] and collection.count() == 0:
+            # The collection was dropped but the manifest survived: start over
+            print("Collection is empty, ignoring the existing manifest.")
+            manifest = new_manifest()
+
+        stats = {"unchanged": 0, "processed": 0, "upserted": 0, "deleted": 0, "errors": []}
+
+        # Drop chunks of files that disappeared from the data directory
+        for name in list(manifest["files"]):
+            if name not in sources:
+                stale_ids = list(manifest["files"][name]["chunks"])
+                print(f"Removing {len(stale_ids)} chunks of deleted file: {name}")
+                if stale_ids:
+                    collection.delete(ids=stale_ids)
+                    bump_collection_version(DB_PATH)
+                stats["deleted"] += len(stale_ids)
+                del manifest["files"][name]
+                save_manifest(manifest)
+
+        # Only new or modified files are re-extracted
+        to_process = {}
+        file_hashes = {}
+        for name, path in sources.items():
+            file_hashes[name] = file_sha256(path)
+            previous = manifest["files"].get(name)
+            if previous and previous["hash"] == file_hashes[name]:
+                stats["unchanged"] += 1
+            else:
+                to_process[name] = path
+
+        def extracted():
+            if "manual_qa.json" in to_process:
+                yield "manual_qa.json", load_manual_qa(to_process["manual_qa.json"]), None
+            file_paths = [path for name, path in to_process.items() if name != "manual_qa.json"]
+            for path, docs, error in extract_files(file_paths):
+                yield os.path.basename(path), docs, error
+
+        # Chunks are upserted in fixed-size batches. A file is committed to the manifest only once
+        # all of its chunks have been flushed, so an interrupted run resumes from the last committed file.
+        batch = []
+        pending_files = []
+
+        def flush():
+            if batch:
+                print(f"Upserting batch of {len(batch)} chunks into ChromaDB...")
+                contents = [doc["content"] for doc in batch]
+                collection.upsert(
+                    documents=contents,
+                    embeddings=embedding_service.embed(contents),
+                    metadatas=[doc["metadata"] for doc in batch],
+                    ids=[doc["id"] for doc in batch]
+                )
+                stats["upserted"] += len(batch)
+                batch.clear()
+                bump_collection_version(DB_PATH)
+            for name, entry in pending_files:
+                manifest["files"][name] = entry
+            if pending_files:
+                save_manifest(manifest)
+                pending_files.clear()
 
-        # Upsert into ChromaDB
-        print(f"Ingesting {len(documents)} chunks into ChromaDB...")
-        collection.upsert(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
+        for name, docs, error in extracted():
+            if error:
+                # Left out of the manifest so the file is retried on the next run
+                print(f"Skipping {name}, extraction failed: {error}")
+                stats["errors"].append(name)
+                continue
+            stats["processed"] += 1
+
+            previous = manifest["files"].get(name)
+            old_chunks = previous["chunks"] if previous else {}
+            new_chunks = {}
+            changed = 0
+            for doc in docs:
+                new_chunks[doc["id"]] = chunk_hash(doc)
+                if old_chunks.get(doc["id"]) != new_chunks[doc["id"]]:
+                    batch.append(doc)
+                    changed += 1
+                    if len(batch) >= UPSERT_BATCH_SIZE:
+                        flush()
+
+            stale_ids = [chunk_id for chunk_id in old_chunks if chunk_id not in new_chunks]
+            if stale_ids:
+                print(f"Removing {len(stale_ids)} stale chunks of {name}")
+                collection.delete(ids=stale_ids)
+                bump_collection_version(DB_PATH)
+                stats["deleted"] += len(stale_ids)
+
+            print(f"{name}: {changed}/{len(docs)} chunks changed")
+            pending_files.append((name, {"hash": file_hashes[name], "chunks": new_chunks}))
+
+        flush()
+
+        # The sparse index covers the same chunk IDs as the collection
+        if stats["upserted"] or stats["deleted"] or not os.path.exists(BM25_INDEX_PATH):
+            bm25 = BM25Index.from_collection(collection)
+            bm25.save(BM25_INDEX_PATH)
+            bump_collection_version(DB_PATH)
+            print(f"BM25 index rebuilt over {len(bm25)} chunks.")
+
+        print(
+            f"Ingestion complete! {stats['processed']} files processed, {stats['unchanged']} unchanged, "
+            f"{stats['upserted']} chunks upserted, {stats['deleted']} chunks deleted."
+        )
+        if stats["errors"]:
+            print(f"Extraction failed for: {', '.join(stats['errors'])}")
+        embedding_stats = embedding_service.stats()
+        print(
+            f"Embeddings: {embedding_stats['encoded']} encoded, {embedding_stats['cache_hits']} from cache, "
+            f"{embedding_stats['sentences_per_second']} sentences/s"
         )
-        print("Ingestion complete!")
 
     except Exception as e:
         print(f"An error occurred during DB operation: {e}")
@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+from chat_client import iter_sse_events
+from benchmark_data import load_question_set, percentiles
+from rag_cache import normalize_query
+
+# Configuration
+CHAT_API_URL = os.getenv("CHAT_API_URL", "http://localhost:8000")
+DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "qwen2.5:1.5b")
+RESULTS_DIR = "benchmarks"
+# Concurrent sessions of each step of the ramp, and how long each step lasts
+LOAD_LEVELS = "1,2,4,8,16,32"
+LOAD_STEP_SECONDS = 60
+# A simulated customer asks a few questions, reading each answer before the next one
+TURNS_PER_SESSION = 3
+THINK_TIME_SECONDS = 2.0
+FOLLOW_UP_SHARE = 0.4
+# Pause of a session after a rejection or an error (the chat server answers 503 with Retry-After: 5)
+RETRY_BACKOFF_SECONDS = 5.0
+# Saturation, measured on the turns answered by the LLM: their throughput grows by less than this
+# share from one step to the next, or their p95 time to first token exceeds the SLO, or too many
+# turns fail or are rejected
+SATURATION_MIN_GAIN = 0.1
+TTFT_SLO_MS = float(os.getenv("TTFT_SLO_MS", "5000"))
+MAX_ERROR_RATE = 0.01
+
+# Relances courtes, comme en posent les clients après une première réponse
+FOLLOW_UPS = [
+    "Et quels sont les frais ?",
+    "Et pour les entreprises ?",
+    "Et quel est le délai ?",
+    "Et si j'ai perdu ma carte ?",
+    "Est-ce que c'est possible depuis l'application ?",
+    "What about the fees?",
+]
+
+async def chat_turn(client, api_url, messages, model, use_answer_cache=False):
+    """One /chat call: time to the first token and to the end of the stream, path taken, errors."""
+    result = {"ttft_ms": None, "e2e_ms": None, "path": None, "tokens": 0, "answer": "",
+              "queued": False, "rejected": False, "error": None}
+    parts = []
+    started = time.perf_counter()
+    try:
+        async with client.stream("POST", f"{api_url.rstrip('/')}/chat",
+                                 json={"messages": messages, "model": model,
+                                       "answer_cache": use_answer_cache}) as response:
+            if response.status_code == 503:
+                await response.aread()
+                result["rejected"] = True
+                return result
+            response.raise_for_status()
+            block = []
+            async for line in response.aiter_lines():
+                if line:
+                    block.append(line)
+                    continue
+                for event, data in iter_sse_events(block):
+                    if event == "meta":
+                        result["path"] = "faq" if data.get("faq") else "answer_cache" if data.get("cached") else "llm"
+                    elif event == "queue":
+                        result["queued"] = True
+                    elif event == "token":
+                        if result["ttft_ms"] is None:
+                            result["ttft_ms"] = (time.perf_counter() - started) * 1000
+                        result["tokens"] += 1
+                        parts.append(data.get("content", ""))
+                    elif event == "error":
+                        if data.get("code") == "queue_full":
+                            result["rejected"] = True
+                        else:
+                            result["error"] = data.get("message", "error")
+                block = []
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["e2e_ms"] = (time.perf_counter() - started) * 1000
+    result["answer"] = "".join(parts)
+    return result
+
+async def run_session(client, api_url, model, questions, rng, deadline, results,
+                      turns=TURNS_PER_SESSION, think_time=THINK_TIME_SECONDS, use_answer_cache=False):
+    """A simulated customer: a first question, then new questions or follow-ups on the same conversation."""
+    messages = []
+    for _ in range(turns):
+        if time.perf_counter() >= deadline:
+            return
+        if messages and rng.random() < FOLLOW_UP_SHARE:
+            question = rng.choice(FOLLOW_UPS)
+        else:
+            question = rng.choice(questions)
+        messages.append({"role": "user", "content": question})
+        result = await chat_turn(client, api_url, messages, model, use_answer_cache)
+        answer = result.pop("answer")
+        results.append(result)
+        if result["error"] or result["rejected"]:
+            await asyncio.sleep(RETRY_BACKOFF_SECONDS * rng.uniform(0.5, 1.5))
+            return
+        messages.append({"role": "assistant", "content": answer})
+        await asyncio.sleep(think_time * rng.uniform(0.5, 1.5))
+
+async def run_level(api_url, model, questions, concurrency, duration, seed=0, **session_options):
+    """Keep `concurrency` sessions running for `duration` seconds; turns in flight at the end are awaited."""
+    results = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(None, connect=10.0)) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def worker(index):
+            rng = random.Random(seed * 1000 + index)
+            while time.perf_counter() < deadline:
+                await run_session(client, api_url, model, questions, rng, deadline, results, **session_options)
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return summarize_level(concurrency, results, elapsed)
+
+def _latency_stats(turns, elapsed):
+    return {
+        "turns": len(turns),
+        "throughput_turns_per_s": round(len(turns) / elapsed, 3) if elapsed > 0 else 0.0,
+        "tokens_per_s": round(sum(r["tokens"] for r in turns) / elapsed, 1) if elapsed > 0 else 0.0,
+        "ttft_ms": percentiles([r["ttft_ms"] for r in turns if r["ttft_ms"] is not None]),
+        "e2e_ms": percentiles([r["e2e_ms"] for r in turns]),
+    }
+
+def summarize_level(concurrency, results, elapsed):
+    """Figures of one step, over all completed turns and over the turns answered by the LLM ("llm")."""
+    completed = [r for r in results if not r["error"] and not r["rejected"]]
+    errors = sum(1 for r in results if r["error"])
+    rejected = sum(1 for r in results if r["rejected"])
+    paths = {}
+    for r in completed:
+        paths[r["path"]] = paths.get(r["path"], 0) + 1
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 1),
+        "turns": len(results),
+        "completed": len(completed),
+        "errors": errors,
+        "rejected": rejected,
+        "queued": sum(1 for r in results if r["queued"]),
+        "error_rate": round((errors + rejected) / len(results), 4) if results else 0.0,
+        "paths": paths,
+        "throughput_turns_per_s": round(len(completed) / elapsed, 3) if elapsed > 0 else 0.0,
+        "tokens_per_s": round(sum(r["tokens"] for r in completed) / elapsed, 1) if elapsed > 0 else 0.0,
+        "ttft_ms": percentiles([r["ttft_ms"] for r in completed if r["ttft_ms"] is not None]),
+        "e2e_ms": percentiles([r["e2e_ms"] for r in completed]),
+        "llm": _latency_stats([r for r in completed if r["path"] == "llm"], elapsed),
+        "sample_errors": sorted({r["error"] for r in results if r["error"]})[:5],
+    }
+
+def find_saturation(levels, min_gain=SATURATION_MIN_GAIN, ttft_slo_ms=TTFT_SLO_MS, max_error_rate=MAX_ERROR_RATE):
+    """
+    First step of the ramp where adding sessions stops paying off, with the reasons, and the
+    highest concurrency before it. None when the ramp never saturated.
+    """
+    previous = None
+    for level in levels:
+        reasons = []
+        if level["error_rate"] > max_error_rate:
+            reasons.append(f"{level['error_rate']:.1%} of turns failed or were rejected")
+        llm = level["llm"]
+        p95 = llm["ttft_ms"]["p95"]
+        if p95 is not None and p95 > ttft_slo_ms:
+            reasons.append(f"LLM p95 TTFT {p95:.0f} ms above the {ttft_slo_ms:.0f} ms SLO")
+        if previous and llm["throughput_turns_per_s"] < previous["llm"]["throughput_turns_per_s"] * (1 + min_gain):
+            reasons.append(f"LLM throughput {previous['llm']['throughput_turns_per_s']} -> {llm['throughput_turns_per_s']} turns/s")
+        if reasons:
+            return {"concurrency": level["concurrency"],
+                    "max_sustainable_concurrency": previous["concurrency"] if previous else None,
+                    "reasons": reasons}
+        previous = level
+    return None
+
+async def wait_until_ready(api_url, timeout):
+    """Poll /ready so that the warm-up does not count in the first step."""
+    deadline = time.perf_counter() + timeout
+    async with httpx.AsyncClient(timeout=5) as client:
+        while True:
+            try:
+                response = await client.get(f"{api_url.rstrip('/')}/ready")
+                if response.status_code in (200, 404):
+                    return True
+            except httpx.HTTPError:
+                pass
+            if time.perf_counter() >= deadline:
+                return False
+            await asyncio.sleep(2)
+
+async def run_load_test(api_url, model, questions, levels, duration, ready_timeout=300, **session_options):
+    if not await wait_until_ready(api_url, ready_timeout):
+        raise RuntimeError(f"{api_url} is not ready after {ready_timeout}s")
+    results = []
+    for i, concurrency in enumerate(levels):
+        print(f"Step {i + 1}/{len(levels)}: {concurrency} concurrent sessions for {duration}s...")
+        level = await run_level(api_url, model, questions, concurrency, duration, seed=i, **session_options)
+        results.append(level)
+        llm = level["llm"]
+        print(f"  LLM: {llm['throughput_turns_per_s']} turns/s, {llm['tokens_per_s']} tokens/s, "
+              f"TTFT p50/p95 {llm['ttft_ms']['p50']}/{llm['ttft_ms']['p95']} ms, "
+              f"E2E p50/p95 {llm['e2e_ms']['p50']}/{llm['e2e_ms']['p95']} ms; "
+              f"paths {level['paths']}, {level['errors']} errors, {level['rejected']} rejected")
+        if not session_options.get("use_answer_cache") and level["paths"].get("answer_cache"):
+            print("  Warning: answers were replayed from the answer cache; the server ignores \"answer_cache\": false "
+                  "(older chat_server.py?) and should run with ANSWER_CACHE=0.")
+    return results
+
+def load_test_questions(questions_path=None):
+    """
+    Reformulations of the FAQ that do not normalise to a FAQ question (those would take the
+    exact-match fast path and never reach the LLM), plus the optional custom questions.
+    """
+    question_set = load_question_set(questions_path, with_paraphrases=True)
+    faq_keys = {normalize_query(q["question"]) for q in question_set if q["kind"] == "manual"}
+    questions = []
+    for q in question_set:
+        if q["kind"] == "custom" or normalize_query(q["question"]) not in faq_keys:
+            questions.append(q["question"])
+    return list(dict.fromkeys(questions))
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du serveur de chat : sessions simultanées, débit, TTFT et point de saturation.")
+    parser.add_argument("--url", default=CHAT_API_URL, help="URL du serveur de chat (chat_server.py)")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--levels", default=LOAD_LEVELS, help="Paliers de sessions simultanées, ex. 1,2,4,8")
+    parser.add_argument("--duration", type=float, default=LOAD_STEP_SECONDS, help="Durée de chaque palier (s)")
+    parser.add_argument("--turns", type=int, default=TURNS_PER_SESSION, help="Questions par session")
+    parser.add_argument("--think-time", type=float, default=THINK_TIME_SECONDS, help="Pause moyenne entre deux questions (s)")
+    parser.add_argument("--questions", help="JSONL de questions supplémentaires (en plus de la FAQ reformulée)")
+    parser.add_argument("--ready-timeout", type=float, default=300, help="Attente maximale de /ready (s)")
+    parser.add_argument("--use-answer-cache", action="store_true",
+                        help="Laisser le serveur rejouer les réponses en cache (par défaut chaque tour passe par le LLM)")
+    parser.add_argument("--output", help="Fichier JSON de sortie (défaut: benchmarks/load_<date>.json)")
+    args = parser.parse_args()
+
+    questions = load_test_questions(args.questions)
+    if not questions:
+        print("No questions to send.")
+        return
+    levels = [int(n) for n in args.levels.split(",") if n.strip()]
+
+    print(f"Load test of {args.url} with {len(questions)} questions, model {args.model}...")
+    results = asyncio.run(run_load_test(args.url, args.model, questions, levels, args.duration, args.ready_timeout,
+                                        turns=args.turns, think_time=args.think_time,
+                                        use_answer_cache=args.use_answer_cache))
+    saturation = find_saturation(results)
+    report = {
+        "url": args.url,
+        "model": args.model,
+        "step_seconds": args.duration,
+        "turns_per_session": args.turns,
+        "think_time_s": args.think_time,
+        "answer_cache": args.use_answer_cache,
+        "levels": results,
+        "saturation": saturation,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if saturation:
+        print(f"Saturation at {saturation['concurrency']} sessions ({'; '.join(saturation['reasons'])}); "
+              f"highest sustainable step: {saturation['max_sustainable_concurrency']}")
+    else:
+        print(f"No saturation up to {levels[-1]} sessions.")
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Configuration
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Histogram buckets in seconds, from cache hits to long CPU generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape_label(value):
+    """Escape a label value as required by the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=None):
+    items = list(key) + (list(extra.items()) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in items) + "}"
+
+class MetricsRegistry:
+    """Minimal thread-safe counters, gauges and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    def inc(self, name, value=1, help="", **labels):
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, help="", **labels):
+        with self._lock:
+            self._help.setdefault(name, ("gauge", help))
+            self._gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, help="", buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(hist["buckets"]):
+                if value <= bound:
+                    hist["counts"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help) in sorted(self._help.items()):
+                if help:
+                    lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for key, value in self._counters[name].items():
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                elif kind == "gauge":
+                    for key, value in self._gauges[name].items():
+                        lines.append(f"{name}{_format_labels(key)} {value}")
+                else:
+                    for key, hist in self._histograms[name].items():
+                        for bound, count in zip(hist["buckets"], hist["counts"]):
+                            lines.append(f"{name}_bucket{_format_labels(key, {'le': bound})} {count}")
+                        lines.append(f"{name}_bucket{_format_labels(key, {'le': '+Inf'})} {hist['count']}")
+                        lines.append(f"{name}_sum{_format_labels(key)} {hist['sum']}")
+                        lines.append(f"{name}_count{_format_labels(key)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+class RequestTrace:
+    """
+    Timing spans and counters for one chat turn. Spans feed the `bnm_stage_seconds` histogram;
+    finish() also prints the whole turn as a single JSON log line.
+    """
+
+    def __init__(self, registry=REGISTRY, **fields):
+        self.registry = registry
+        self.request_id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.fields = dict(fields)
+        self.spans = {}
+        self.counters = {}
+        self.errors = []
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage, seconds):
+        self.spans[stage] = round(self.spans.get(stage, 0.0) + seconds * 1000, 3)
+        self.registry.observe("bnm_stage_seconds", seconds, help="Duration of each chat pipeline stage", stage=stage)
+
+    def count(self, event, value=1):
+        self.counters[event] = self.counters.get(event, 0) + value
+        self.registry.inc("bnm_events_total", value, help="Cache hits, threshold rejections and other pipeline events", event=event)
+
+    def error(self, stage, exc):
+        self.errors.append({"stage": stage, "error": f"{type(exc).__name__}: {exc}"})
+        self.registry.inc("bnm_errors_total", help="Errors by pipeline stage", stage=stage)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def finish(self, **fields):
+        self.fields.update(fields)
+        total = time.perf_counter() - self.started
+        self.registry.observe("bnm_request_seconds", total, help="End-to-end duration of a chat turn")
+        self.registry.inc("bnm_requests_total", help="Chat turns served", outcome="error" if self.errors else "ok")
+        print(json.dumps({
+            "event": "chat_turn",
+            "request_id": self.request_id,
+            "total_ms": round(total * 1000, 3),
+            "spans_ms": self.spans,
+            "counters": self.counters,
+            "errors": self.errors,
+            **self.fields,
+        }, ensure_ascii=False), flush=True)
+
+class NullTrace:
+    """Stand-in used when the caller does not trace the request."""
+
+    @contextmanager
+    def span(self, stage):
+        yield
+
+    def record(self, stage, seconds):
+        pass
+
+    def count(self, event, value=1):
+        pass
+
+    def error(self, stage, exc):
+        pass
+
+    def set(self, **fields):
+        pass
+
+    def finish(self, **fields):
+        pass
+
+NULL_TRACE = NullTrace()
+
+def record_cold_start(component, seconds):
+    REGISTRY.set("bnm_cold_start_seconds", round(seconds, 3), help="Time to initialise heavy components", component=component)
+    print(f"Cold start: {component} ready in {seconds:.2f}s")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server = None
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics from a daemon thread (for processes without their own HTTP server)."""
+    global _server
+    if _server is None and port:
+        _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    return _server
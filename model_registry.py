@@ -0,0 +1,94 @@
+import os
+import time
+import threading
+
+# Configuration
+MODEL_REFRESH_INTERVAL = float(os.getenv("MODEL_REFRESH_INTERVAL", "30"))
+
+def parse_model_names(models_info):
+    """Extract model names from an ollama list() response, whether dicts or objects."""
+    # Handle response being either a dict or an object
+    if isinstance(models_info, dict):
+        models_list = models_info.get('models', [])
+    else:
+        models_list = getattr(models_info, 'models', [])
+
+    available_models = []
+    for m in models_list:
+        # Handle item being either a dict or an object
+        if isinstance(m, dict):
+            model_name = m.get('name') or m.get('model')
+        else:
+            model_name = getattr(m, 'name', None) or getattr(m, 'model', None)
+
+        if model_name:
+            available_models.append(model_name)
+    return available_models
+
+class ModelRegistry:
+    """
+    Background-refreshed view of the models installed in Ollama.
+    Readers never touch the network: they get the last snapshot, refreshed every `interval` seconds.
+    """
+
+    def __init__(self, client, interval=MODEL_REFRESH_INTERVAL):
+        self.client = client
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._models = []
+        self._healthy = None  # None until the first refresh completes
+        self._last_error = None
+        self._last_refresh = None
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ollama-model-registry", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def refresh(self):
+        try:
+            models = parse_model_names(self.client.list())
+            with self._lock:
+                self._models = models
+                self._healthy = True
+                self._last_error = None
+                self._last_refresh = time.time()
+        except Exception as e:
+            with self._lock:
+                self._healthy = False
+                self._last_error = str(e)
+                self._last_refresh = time.time()
+
+    def request_refresh(self):
+        """Ask the background thread to refresh now (non-blocking)."""
+        self._wake.set()
+
+    @property
+    def healthy(self):
+        with self._lock:
+            return self._healthy
+
+    def is_available(self, model):
+        """None while unknown, else whether the model is installed (partial match, e.g. qwen2.5:7b:latest)."""
+        with self._lock:
+            if not self._healthy:
+                return None
+            return any(model in m for m in self._models)
+
+    def is_known(self, model):
+        """Exact match against the last snapshot ("name" also matches "name:latest")."""
+        with self._lock:
+            return model in self._models or f"{model}:latest" in self._models
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "healthy": self._healthy,
+                "models": list(self._models),
+                "last_error": self._last_error,
+                "last_refresh": self._last_refresh,
+            }
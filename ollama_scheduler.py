@@ -0,0 +1,124 @@
+import os
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Configuration, e.g. OLLAMA_MAX_IN_FLIGHT="qwen2.5:1.5b=4,qwen2.5:7b=1"
+OLLAMA_MAX_IN_FLIGHT = os.getenv("OLLAMA_MAX_IN_FLIGHT", "qwen2.5:1.5b=4,qwen2.5:7b=1")
+OLLAMA_MAX_QUEUE = os.getenv("OLLAMA_MAX_QUEUE", "qwen2.5:1.5b=16,qwen2.5:7b=4")
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("DEFAULT_MAX_IN_FLIGHT", "2"))
+DEFAULT_MAX_QUEUE = int(os.getenv("DEFAULT_MAX_QUEUE", "8"))
+# How often a queued request re-checks (and reports) its position
+POSITION_UPDATE_INTERVAL = 1.0
+
+class QueueFullError(Exception):
+    """Raised when a model's wait queue is full: the request is rejected immediately."""
+
+def parse_model_limits(spec):
+    """Parse "model=value,model=value" into a dict."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            model, value = item.rsplit("=", 1)
+            limits[model.strip()] = int(value)
+    return limits
+
+class ModelBudget:
+    def __init__(self, max_in_flight, max_queue):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters = deque()
+
+class OllamaScheduler:
+    """
+    Per-model admission control in front of Ollama: at most `max_in_flight` generations run
+    at once, up to `max_queue` more wait in FIFO order, and anything beyond is rejected.
+    Each model has its own budget, so the 7B model cannot starve the 1.5B one.
+    """
+
+    def __init__(self, max_in_flight=None, max_queue=None,
+                 default_in_flight=DEFAULT_MAX_IN_FLIGHT, default_queue=DEFAULT_MAX_QUEUE):
+        self.max_in_flight = max_in_flight or {}
+        self.max_queue = max_queue or {}
+        self.default_in_flight = default_in_flight
+        self.default_queue = default_queue
+        self.budgets = {}
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(parse_model_limits(OLLAMA_MAX_IN_FLIGHT), parse_model_limits(OLLAMA_MAX_QUEUE))
+
+    def _budget(self, model):
+        budget = self.budgets.get(model)
+        if budget is None:
+            budget = ModelBudget(
+                self.max_in_flight.get(model, self.default_in_flight),
+                self.max_queue.get(model, self.default_queue),
+            )
+            self.budgets[model] = budget
+        return budget
+
+    def is_configured(self, model):
+        """True if `model` has its own limit in OLLAMA_MAX_IN_FLIGHT."""
+        return model in self.max_in_flight
+
+    def is_full(self, model):
+        """True if a new request for `model` would be rejected right now."""
+        budget = self._budget(model)
+        return budget.in_flight >= budget.max_in_flight and len(budget.waiters) >= budget.max_queue
+
+    def status(self):
+        return {
+            model: {"in_flight": b.in_flight, "queued": len(b.waiters),
+                    "max_in_flight": b.max_in_flight, "max_queue": b.max_queue}
+            for model, b in self.budgets.items()
+        }
+
+    def _release(self, budget):
+        # Hand the slot straight to the next live waiter, so in_flight never dips below the limit
+        while budget.waiters:
+            waiter = budget.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        budget.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, model, on_position=None):
+        """
+        Hold a generation slot for `model` for the duration of the block.
+        `on_position(position)` is awaited whenever the queue position changes.
+        Raises QueueFullError if the wait queue is full.
+        """
+        budget = self._budget(model)
+        if budget.in_flight < budget.max_in_flight and not budget.waiters:
+            budget.in_flight += 1
+        else:
+            if len(budget.waiters) >= budget.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"File d'attente pleine pour le modèle {model}")
+            waiter = asyncio.get_running_loop().create_future()
+            budget.waiters.append(waiter)
+            try:
+                last_position = None
+                while not waiter.done():
+                    position = budget.waiters.index(waiter) + 1
+                    if on_position and position != last_position:
+                        await on_position(position)
+                        last_position = position
+                    await asyncio.wait({waiter}, timeout=POSITION_UPDATE_INTERVAL)
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was handed over while we were leaving: pass it on
+                    self._release(budget)
+                else:
+                    waiter.cancel()
+                    if waiter in budget.waiters:
+                        budget.waiters.remove(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release(budget)
@@ -0,0 +1,169 @@
+import os
+import json
+import argparse
+import numpy as np
+
+# Configuration
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join("models", f"{EMBEDDING_MODEL}-onnx-int8"))
+# 0 lets ONNX Runtime pick the number of intra-op threads
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))
+# Minimum cosine similarity between ONNX vectors and the vectors already stored in Chroma
+PARITY_MIN_COSINE = float(os.getenv("PARITY_MIN_COSINE", "0.98"))
+PARITY_SAMPLES = 200
+CONFIG_FILE = "embedder_config.json"
+
+class OnnxEmbedder:
+    """
+    Sentence-transformers model exported to ONNX (optionally int8-quantized), run with ONNX Runtime.
+    Same encode() contract as SentenceTransformer for what EmbeddingService uses, without loading torch.
+    """
+
+    def __init__(self, model_dir=EMBEDDING_ONNX_DIR, threads=EMBEDDING_ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, "model.onnx"), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: value for name, value in inputs.items() if name in self.input_names})[0]
+        # Mean pooling over the real tokens, as the sentence-transformers Pooling module does
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.config.get("normalize"):
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        # Batches of similar length waste less work on padding
+        order = sorted(range(len(sentences)), key=lambda i: len(sentences[i]))
+        vectors = [None] * len(sentences)
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            for i, vector in zip(batch, self._encode_batch([sentences[i] for i in batch])):
+                vectors[i] = vector
+        vectors = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        return vectors[0] if single else vectors
+
+def export_model(model_name=EMBEDDING_MODEL, output_dir=EMBEDDING_ONNX_DIR, quantize=True):
+    """One-time export of the sentence-transformers model to ONNX, then dynamic int8 quantization."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize
+
+    print(f"Exporting {model_name} to {output_dir} (quantize={quantize})...")
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model
+    tokenizer = st_model.tokenizer
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer.save_pretrained(output_dir)
+
+    dummy = tokenizer(["export"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    fp32_path = os.path.join(output_dir, "model_fp32.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+    transformer.eval()
+    with torch.no_grad():
+        torch.onnx.export(transformer, tuple(dummy[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=14)
+
+    model_path = os.path.join(output_dir, "model.onnx")
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+    else:
+        os.replace(fp32_path, model_path)
+
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "max_seq_length": st_model.max_seq_length,
+            "pad_token_id": tokenizer.pad_token_id,
+            "pad_token": tokenizer.pad_token,
+            "normalize": any(isinstance(module, Normalize) for module in st_model),
+            "quantized": quantize,
+        }, f, indent=2)
+    size_mb = os.path.getsize(model_path) / 1e6
+    print(f"Export complete: {model_path} ({size_mb:.1f} MB)")
+
+def check_parity(model_dir=EMBEDDING_ONNX_DIR, samples=PARITY_SAMPLES, min_cosine=PARITY_MIN_COSINE):
+    """
+    Re-embed stored chunks with the ONNX model and compare with the vectors already in Chroma.
+    Also checks that each re-embedded chunk still finds itself first among the sampled vectors.
+    """
+    import time
+    import chromadb
+    from embedding_service import get_collection
+    from rag_pipeline import DB_PATH, COLLECTION_NAME
+
+    collection = get_collection(chromadb.PersistentClient(path=DB_PATH), COLLECTION_NAME)
+    stored = collection.get(include=["documents", "embeddings"], limit=samples)
+    texts = [doc or "" for doc in stored["documents"]]
+    if not texts:
+        print("No stored chunks to compare with.")
+        return False
+    reference = np.asarray(stored["embeddings"], dtype=np.float32)
+
+    embedder = OnnxEmbedder(model_dir)
+    started = time.perf_counter()
+    vectors = embedder.encode(texts)
+    elapsed = time.perf_counter() - started
+
+    reference /= np.maximum(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    cosines = (reference * vectors).sum(axis=1)
+    self_retrieval = float(np.mean(np.argmax(vectors @ reference.T, axis=1) == np.arange(len(texts))))
+
+    report = {
+        "samples": len(texts),
+        "cosine_min": round(float(cosines.min()), 4),
+        "cosine_mean": round(float(cosines.mean()), 4),
+        "self_retrieval@1": round(self_retrieval, 4),
+        "sentences_per_second": round(len(texts) / elapsed, 1) if elapsed > 0 else None,
+    }
+    print(json.dumps(report, indent=2))
+    passed = report["cosine_min"] >= min_cosine
+    print("Parity OK." if passed else f"Parity FAILED: minimum cosine below {min_cosine}.")
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend ONNX Runtime du modèle d'embedding (export et contrôle de parité).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Exporter le modèle en ONNX (une seule fois)")
+    export_parser.add_argument("--no-quantize", action="store_true", help="Garder les poids en float32")
+    export_parser.add_argument("--output", default=EMBEDDING_ONNX_DIR)
+    parity_parser = subparsers.add_parser("parity", help="Comparer avec les vecteurs déjà stockés dans Chroma")
+    parity_parser.add_argument("--model-dir", default=EMBEDDING_ONNX_DIR)
+    parity_parser.add_argument("--samples", type=int, default=PARITY_SAMPLES)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_model(output_dir=args.output, quantize=not args.no_quantize)
+    elif not check_parity(args.model_dir, args.samples):
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+import re
+import hashlib
+from bm25_index import tokenize
+from rag_cache import TTLCache
+
+# Configuration
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Optional small model used to rewrite follow-ups ("" = rule-based only)
+QUERY_REWRITE_MODEL = os.getenv("QUERY_REWRITE_MODEL", "")
+QUERY_REWRITE_TIMEOUT = float(os.getenv("QUERY_REWRITE_TIMEOUT", "3"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "1800"))
+# A question with at most this many content words is treated as a follow-up
+FOLLOW_UP_MAX_TERMS = 3
+
+# Relances typiques : "et pour les entreprises ?", "what about the fees?", "وماذا عن ..."
+# "و" is written attached to the next word: only the standalone conjunction or "و" + a question word
+# counts, not any word starting with it ("وثائق" = documents)
+FOLLOW_UP_START = re.compile(
+    r"^\s*(?:(?:et|mais|sinon|aussi|and|but|also|what about|how about)\b|و(?:\s|(?:ماذا|ما|هل|كيف|بالنسبة|أيضا)\b))",
+    re.IGNORECASE,
+)
+ANAPHORA = {"il", "elle", "ils", "elles", "celui", "celle", "ceux", "ce", "cette", "ces", "ça", "cela",
+            "it", "its", "this", "that", "these", "those", "they", "them"}
+
+REWRITE_PROMPT = """Réécris la dernière question de l'utilisateur pour qu'elle soit compréhensible sans l'historique.
+Garde la langue de l'utilisateur. Réponds uniquement par la question réécrite.
+
+Historique :
+{history}
+
+Dernière question : {question}
+Question réécrite :"""
+
+def conversation_key(user_messages):
+    """Key of a conversation state: hash of its user messages, so no session ID is needed."""
+    h = hashlib.sha256()
+    for content in user_messages:
+        h.update(content.strip().encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+def is_follow_up(question):
+    """Rule-based: an opening connector, or a short question leaning on a pronoun."""
+    if FOLLOW_UP_START.match(question):
+        return True
+    words = set(re.findall(r"\w+", question.lower()))
+    return len(tokenize(question)) <= FOLLOW_UP_MAX_TERMS and bool(words & ANAPHORA)
+
+def covers(question, hits):
+    """True when every content word of the question already appears in the retrieved chunks."""
+    terms = set(tokenize(question))
+    if not terms or not hits:
+        return False
+    seen = set()
+    for hit in hits:
+        seen.update(tokenize(hit["content"]))
+    return terms <= seen
+
+class QueryRewriter:
+    """
+    Turns the last user message into a standalone retrieval query, and keeps the retrieval state
+    of recent conversations so that a follow-up on the same product can reuse the previous chunks.
+    """
+
+    def __init__(self, model=QUERY_REWRITE_MODEL, timeout=QUERY_REWRITE_TIMEOUT):
+        self.model = model
+        self.timeout = timeout
+        self.sessions = TTLCache(maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+        self._client = None
+
+    def previous_state(self, messages):
+        user_messages = [m["content"] for m in messages if m["role"] == "user"]
+        if len(user_messages) < 2:
+            return None
+        return self.sessions.get(conversation_key(user_messages[:-1]))
+
+    def save_state(self, messages, query, hits, version, subject):
+        user_messages = [m["content"] for m in messages if m["role"] == "user"]
+        self.sessions.put(conversation_key(user_messages),
+                          {"query": query, "hits": hits, "version": version, "subject": subject})
+
+    def rewrite(self, messages, previous=None, names_product=False):
+        """
+        Standalone query for the last user message, and the subject it refers to, as (query, subject).
+        The query is the message itself when it is not a follow-up; a message naming a product
+        only counts as a follow-up when it opens with a connector ("et pour la Mastercard ?").
+        """
+        question = messages[-1]["content"]
+        earlier = [m["content"] for m in messages[:-1] if m["role"] == "user"]
+        if not earlier or not is_follow_up(question) or (names_product and not FOLLOW_UP_START.match(question)):
+            return question, question
+        # Subject of the conversation: the last standalone question, carried over by follow-ups
+        subject = previous["subject"] if previous else earlier[-1]
+        if self.model:
+            rewritten = self._llm_rewrite(messages, question)
+            if rewritten:
+                return rewritten, subject
+        return f"{subject.strip()} {question.strip()}", subject
+
+    def _llm_rewrite(self, messages, question):
+        try:
+            if self._client is None:
+                import ollama
+                self._client = ollama.Client(host=OLLAMA_HOST, timeout=self.timeout)
+            history = "\n".join(f"{m['role']}: {m['content']}" for m in messages[-5:-1])
+            response = self._client.generate(
+                model=self.model,
+                prompt=REWRITE_PROMPT.format(history=history, question=question),
+                options={"temperature": 0, "num_predict": 64},
+            )
+            rewritten = response["response"].strip().splitlines()[0].strip() if response["response"].strip() else ""
+            return rewritten or None
+        except Exception as e:
+            print(f"Query rewrite failed, using the rule-based rewrite: {e}")
+            return None
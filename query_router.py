@@ -0,0 +1,98 @@
+import os
+from bm25_index import tokenize
+
+# Configuration
+QUERY_ROUTING = os.getenv("QUERY_ROUTING", "1") == "1"
+# Share of a product name's words that must appear in the question to route to it
+ROUTE_MIN_SHARE = 0.6
+# Sources searched together with any routed product: the manual FAQ covers every product
+ALWAYS_SEARCHED = ("manual_qa.json",)
+# Words of the file names that do not name a product
+NAME_NOISE = {"version", "offre", "fiche", "produit", "docx", "pdf", "txt", "md", "json"}
+# Customer segments and generic banking words of the file names: "pour les entreprises" must not
+# send every question to "Compte Courant Entreprise" and hide the other products
+GENERIC_TERMS = {"entreprise", "particulier", "professionnel", "compte", "courant", "banking", "carte", "client"}
+
+def _stem(term):
+    # Light plural folding so that "caution" matches "Cautions"
+    return term[:-1] if len(term) > 4 and term[-1] in "sx" else term
+
+def product_terms(source):
+    """Words naming the product in a file name ("mastercard_version 01.docx" -> {"mastercard"})."""
+    stem = os.path.splitext(source)[0]
+    terms = {
+        _stem(t) for t in tokenize(stem.replace("_", " "))
+        if t not in NAME_NOISE and not t.isdigit() and len(t) >= 3
+    }
+    return terms - GENERIC_TERMS
+
+class QueryRouter:
+    """
+    Keyword router from a question to the sources (documents) it is about, built from the file names
+    of the collection. A product is routed to when one of its distinctive words appears in the question
+    (a word no other file name uses) or when most of its name does.
+    """
+
+    def __init__(self, id_sources):
+        self.source_ids = {}
+        for doc_id, source in id_sources.items():
+            self.source_ids.setdefault(source, set()).add(doc_id)
+        self.sources = sorted(self.source_ids)
+        self.terms = {source: product_terms(source) for source in self.sources if source not in ALWAYS_SEARCHED}
+        self.term_sources = {}
+        for source, terms in self.terms.items():
+            for term in terms:
+                self.term_sources.setdefault(term, set()).add(source)
+
+    @classmethod
+    def from_collection(cls, collection, page_size=1000):
+        id_sources = {}
+        offset = 0
+        while True:
+            page = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            for doc_id, meta in zip(page["ids"], page["metadatas"]):
+                id_sources[doc_id] = (meta or {}).get("source", "Inconnu")
+            offset += len(page["ids"])
+        return cls(id_sources)
+
+    def route(self, query):
+        """Sources the query is about, or [] when it should search the whole collection."""
+        return self.match(query)[0]
+
+    def match(self, query):
+        """
+        (sources, exclusive): the sources the query is about, and whether the search may be restricted
+        to them. It may only when each source is named by one of its own words; sources matched on
+        shared words are searched together with the whole collection.
+        """
+        query_terms = {_stem(t) for t in tokenize(query)}
+        distinctive, partial = [], []
+        for source, terms in self.terms.items():
+            if not terms:
+                continue
+            present = terms & query_terms
+            if any(len(self.term_sources[t]) == 1 for t in present):
+                distinctive.append(source)
+            elif len(present) / len(terms) >= ROUTE_MIN_SHARE:
+                partial.append(source)
+        # A distinctive word names one product, shared words may name several
+        routed = distinctive or partial
+        if len(routed) == len(self.terms):
+            return [], False
+        return routed, bool(distinctive)
+
+    def where(self, sources):
+        """Chroma `where` filter restricting a search to the routed sources."""
+        return {"source": {"$in": list(sources) + [s for s in ALWAYS_SEARCHED if s in self.sources]}}
+
+    def allowed_ids(self, sources):
+        """Chunk IDs of the routed sources, to restrict the lexical search in the same way."""
+        allowed = set()
+        for source in set(sources) | set(ALWAYS_SEARCHED):
+            allowed |= self.source_ids.get(source, set())
+        return allowed
+
+    def __len__(self):
+        return len(self.sources)
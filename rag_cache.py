@@ -0,0 +1,97 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+# Configuration
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+VERSION_FILE = "collection_version"
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def normalize_query(query):
+    """Lower-case, NFKC-normalise and collapse whitespace/trailing punctuation of a query."""
+    text = unicodedata.normalize("NFKC", query).lower().strip()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip(" ?!.;:")
+
+def embedding_key(embedding):
+    """Hashable key for an embedding vector."""
+    return hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+
+def read_collection_version(db_path):
+    """Version stamp written by ingest() each time the collection changes (None if never written)."""
+    try:
+        with open(os.path.join(db_path, VERSION_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def bump_collection_version(db_path):
+    os.makedirs(db_path, exist_ok=True)
+    path = os.path.join(db_path, VERSION_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f"{time.time():.6f}-{uuid.uuid4().hex}")
+    os.replace(tmp_path, path)
+
+class RetrievalCache:
+    """
+    Two-level cache in front of the vector search:
+    normalized query -> embedding, and embedding -> filtered (context, sources).
+    Results are dropped whenever the collection version stamp changes.
+    """
+
+    def __init__(self, db_path, maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL):
+        self.db_path = db_path
+        self.embeddings = TTLCache(maxsize, ttl)
+        self.results = TTLCache(maxsize, ttl)
+        self.version = read_collection_version(db_path)
+
+    def check_version(self):
+        version = read_collection_version(self.db_path)
+        if version != self.version:
+            self.results.clear()
+            self.version = version
@@ -0,0 +1,429 @@
+import os
+import time
+import threading
+import chromadb
+import numpy as np
+from embedding_service import get_embedding_service, get_collection
+from rag_cache import RetrievalCache, normalize_query, embedding_key
+from faq_index import FAQIndex, MANUAL_QA_PATH
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from query_router import QueryRouter, QUERY_ROUTING
+from reranker import get_reranker, RERANK, RERANK_CANDIDATES
+from answer_cache import AnswerCache, ANSWER_CACHE, context_key, query_language
+from query_rewriter import QueryRewriter, covers
+from context_builder import build_system_prompt, estimate_tokens
+from metrics import NULL_TRACE, record_cold_start
+
+# --- CONFIGURATION RAG ---
+DB_PATH = os.getenv("DB_PATH", "chroma_db")
+COLLECTION_NAME = os.getenv("COLLECTION_NAME", "bnm_qa")
+DISTANCE_THRESHOLD = 0.70
+# Looser cutoff for chunks found only by the lexical search, so that a shared word alone
+# does not bring an off-topic chunk into the prompt
+LEXICAL_DISTANCE_THRESHOLD = float(os.getenv("LEXICAL_DISTANCE_THRESHOLD", "0.80"))
+N_RESULTS = 5
+HISTORY_MESSAGES = 5
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+
+def format_source(metadata):
+    """Source to cite for a chunk: the file name, with the page for PDF chunks."""
+    source = metadata.get("source", "Inconnu")
+    if metadata.get("page"):
+        return f"{source} (p. {metadata['page']})"
+    return source
+
+class RAGPipeline:
+    """
+    Retrieval side of a chat turn (FAQ fast path, hybrid search, prompt construction),
+    shared by the Streamlit app and the async chat server. Safe to use from several threads.
+    """
+
+    def __init__(self, db_path=DB_PATH, collection_name=COLLECTION_NAME):
+        self.db_path = db_path
+        self.collection_name = collection_name
+        self.embedding_service = get_embedding_service()
+        self.cache = RetrievalCache(db_path)
+        self.rewriter = QueryRewriter()
+        self._client = None
+        self._collection = None
+        self._collection_version = None
+        self._bm25 = None
+        self._bm25_version = None
+        self._router = None
+        self._router_version = None
+        self._faq_index = None
+        self._faq_mtime = None
+        self._answer_cache = None
+        # Vector search results computed in batch by prefetch_queries(), consumed by _search()
+        self._dense_prefetch = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                started = time.perf_counter()
+                self._client = chromadb.PersistentClient(path=self.db_path)
+                record_cold_start("chroma_client", time.perf_counter() - started)
+        return self._client
+
+    def get_collection(self):
+        # Pinned handle, re-opened only when ingest() publishes a new collection version
+        version = self.cache.version
+        if self._collection is None or self._collection_version != version:
+            collection = get_collection(self.client, self.collection_name)
+            with self._lock:
+                self._collection, self._collection_version = collection, version
+        return self._collection
+
+    def get_bm25_index(self):
+        # Reloaded only when ingest() publishes a new collection version
+        with self._lock:
+            if self._bm25 is None or self._bm25_version != self.cache.version:
+                self._bm25 = BM25Index.load()
+                self._bm25_version = self.cache.version
+            return self._bm25
+
+    def get_router(self):
+        # Rebuilt from the collection's sources when ingest() publishes a new version
+        version = self.cache.version
+        if self._router is None or self._router_version != version:
+            router = QueryRouter.from_collection(self.get_collection())
+            with self._lock:
+                self._router, self._router_version = router, version
+        return self._router
+
+    def get_faq_index(self):
+        # Rebuilt when manual_qa.json is edited
+        mtime = os.path.getmtime(MANUAL_QA_PATH) if os.path.exists(MANUAL_QA_PATH) else None
+        with self._lock:
+            if self._faq_index is None or self._faq_mtime != mtime:
+                self._faq_index = FAQIndex.load(self.embedding_service)
+                self._faq_mtime = mtime
+            return self._faq_index
+
+    def get_answer_cache(self):
+        with self._lock:
+            if self._answer_cache is None and ANSWER_CACHE:
+                self._answer_cache = AnswerCache()
+            return self._answer_cache
+
+    def get_query_embedding(self, query, trace=NULL_TRACE):
+        """Query embedding, served from the in-process cache for repeat questions."""
+        query_key = normalize_query(query)
+        query_embedding = self.cache.embeddings.get(query_key)
+        if query_embedding is None:
+            trace.count("query_embedding_cache_miss")
+            with trace.span("embedding"):
+                query_embedding = self.embedding_service.embed_query(query)
+            self.cache.embeddings.put(query_key, query_embedding)
+        else:
+            trace.count("query_embedding_cache_hit")
+        return query_embedding
+
+    def prefetch_queries(self, queries):
+        """
+        Embed many queries in batches up front, then run their vector searches as one Chroma query
+        per routed product set, so that their retrieval skips both the model and its own search.
+        Replaces the results of the previous call.
+        """
+        queries = list(dict.fromkeys(queries))
+        embeddings = self.embedding_service.embed(queries)
+        for query, embedding in zip(queries, embeddings):
+            self.cache.embeddings.put(normalize_query(query), embedding)
+        prefetched = {}
+        try:
+            if os.path.exists(self.db_path):
+                self.cache.check_version()
+                version = self.cache.version
+                collection = self.get_collection()
+                router = self.get_router() if QUERY_ROUTING else None
+                k = RERANK_CANDIDATES if RERANK and get_reranker() is not None else N_RESULTS
+                groups = {}
+                for embedding, query in zip(embeddings, queries):
+                    routed, exclusive = router.match(query) if router is not None else ([], False)
+                    if routed:
+                        groups.setdefault(tuple(routed), []).append(embedding)
+                    if not routed or not exclusive:
+                        groups.setdefault((), []).append(embedding)
+                for routed, group in groups.items():
+                    where = router.where(list(routed)) if routed else None
+                    results = collection.query(query_embeddings=group, n_results=k, where=where)
+                    for i, embedding in enumerate(group):
+                        prefetched[(embedding_key(embedding), routed, k, version)] = {
+                            field: [results[field][i]] for field in ("ids", "documents", "distances", "metadatas")
+                        }
+        except Exception as e:
+            # Each query then runs its own search, as without prefetching
+            print(f"Batched vector search failed: {e}")
+        with self._lock:
+            self._dense_prefetch = prefetched
+
+    def match_faq(self, query, trace=NULL_TRACE):
+        """Stored manual_qa.json answer for the query if it is close enough, else None."""
+        try:
+            faq_index = self.get_faq_index()
+            # Exact matches are checked before paying for an embedding
+            with trace.span("faq_match"):
+                hit = faq_index.match(query)
+            if hit is None:
+                query_embedding = self.get_query_embedding(query, trace)
+                with trace.span("faq_match"):
+                    hit = faq_index.match(query, query_embedding)
+            if hit:
+                trace.count("faq_hit")
+            return hit
+        except Exception as e:
+            print(f"FAQ lookup failed: {e}")
+            trace.error("faq_match", e)
+            return None
+
+    def _search(self, collection, query, query_embedding, trace, k=N_RESULTS, router=None, routed=None):
+        """Dense and lexical rankings of up to k chunks, restricted to the `routed` sources when given."""
+        where = router.where(routed) if routed else None
+        prefetch_key = (embedding_key(query_embedding), tuple(routed or ()), k, self.cache.version)
+        results = self._dense_prefetch.get(prefetch_key)
+        if results is not None:
+            trace.count("prefetched_search")
+        else:
+            with trace.span("vector_search"):
+                results = collection.query(query_embeddings=[query_embedding], n_results=k, where=where)
+
+        candidates = {}
+        dense_ranking = []
+        rejected = {}
+        if results['documents'] and len(results['documents'][0]) > 0:
+            for doc_id, doc, dist, meta in zip(results['ids'][0], results['documents'][0], results['distances'][0], results['metadatas'][0]):
+                if dist < DISTANCE_THRESHOLD:
+                    candidates[doc_id] = (doc, meta, dist)
+                    dense_ranking.append(doc_id)
+                else:
+                    rejected[doc_id] = (doc, meta, dist)
+                    trace.count("threshold_rejection")
+
+        # Lexical search catches product codes and exact terms the dense model misses.
+        # It only adds to an on-topic dense result: an off-topic question keeps an empty context.
+        lexical_ranking = []
+        bm25 = self.get_bm25_index() if HYBRID_SEARCH and dense_ranking else None
+        if bm25 is not None:
+            allowed_ids = router.allowed_ids(routed) if routed else None
+            with trace.span("lexical_search"):
+                lexical_ranking = [doc_id for doc_id, _ in bm25.search(query, k=k, allowed_ids=allowed_ids)]
+            lexical_ranking = self._filter_lexical(collection, query_embedding, lexical_ranking, candidates, rejected, trace)
+        return candidates, dense_ranking, lexical_ranking
+
+    def _filter_lexical(self, collection, query_embedding, lexical_ranking, candidates, rejected, trace):
+        """Keep the lexical-only chunks within LEXICAL_DISTANCE_THRESHOLD of the query, adding them to `candidates`."""
+        missing_ids = [doc_id for doc_id in lexical_ranking if doc_id not in candidates and doc_id not in rejected]
+        if missing_ids:
+            fetched = collection.get(ids=missing_ids, include=["documents", "metadatas", "embeddings"])
+            query = np.asarray(query_embedding, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            for doc_id, doc, meta, emb in zip(fetched['ids'], fetched['documents'], fetched['metadatas'], fetched['embeddings']):
+                emb = np.asarray(emb, dtype=np.float32)
+                # Same cosine distance as the collection's hnsw:space
+                dist = 1.0 - float(np.dot(query, emb)) / max(float(np.linalg.norm(emb)), 1e-12)
+                rejected[doc_id] = (doc, meta, dist)
+
+        kept = []
+        for doc_id in lexical_ranking:
+            if doc_id in candidates:
+                kept.append(doc_id)
+            elif doc_id in rejected and rejected[doc_id][2] < LEXICAL_DISTANCE_THRESHOLD:
+                candidates[doc_id] = rejected[doc_id]
+                kept.append(doc_id)
+            else:
+                trace.count("lexical_rejection")
+        return kept
+
+    def retrieve(self, query, trace=NULL_TRACE):
+        """
+        Ranked chunks relevant to the query, as dicts {"id", "content", "metadata", "distance"}.
+        """
+        try:
+            if not os.path.exists(self.db_path):
+                return []
+
+            # Repeat questions skip both the embedding model and the vector search
+            self.cache.check_version()
+            query_embedding = self.get_query_embedding(query, trace)
+            result_key = embedding_key(query_embedding)
+            cached = self.cache.results.get(result_key)
+            if cached is not None:
+                trace.count("retrieval_cache_hit")
+                return cached
+            trace.count("retrieval_cache_miss")
+
+            collection = self.get_collection()
+            # With re-ranking, a wider candidate set is fetched and narrowed down by the cross-encoder
+            reranker = get_reranker() if RERANK else None
+            k = RERANK_CANDIDATES if reranker is not None else N_RESULTS
+
+            # Questions naming a product only search that product's documents
+            routed, exclusive = [], False
+            if QUERY_ROUTING:
+                router = self.get_router()
+                with trace.span("routing"):
+                    routed, exclusive = router.match(query)
+            rankings = []
+            if routed:
+                trace.count("routed_search")
+                trace.set(routed_sources=routed)
+                candidates, dense_ranking, lexical_ranking = self._search(collection, query, query_embedding, trace, k, router, routed)
+                if not dense_ranking and not lexical_ranking:
+                    # Nothing relevant in the routed products: fall back to the whole collection
+                    trace.count("routing_fallback")
+                    routed = []
+                else:
+                    rankings = [dense_ranking, lexical_ranking]
+            if not routed or not exclusive:
+                # Routed on shared words only: the routed chunks are boosted, not the only ones searched
+                if routed:
+                    trace.count("routing_merge")
+                routed_candidates = candidates if routed else {}
+                candidates, dense_ranking, lexical_ranking = self._search(collection, query, query_embedding, trace, k)
+                candidates.update(routed_candidates)
+                rankings += [dense_ranking, lexical_ranking]
+
+            ranked_ids = reciprocal_rank_fusion(rankings)[:k]
+            hits = []
+            for doc_id in ranked_ids:
+                doc, meta, dist = candidates[doc_id]
+                hits.append({"id": doc_id, "content": doc, "metadata": meta or {}, "distance": dist})
+
+            if reranker is not None:
+                with trace.span("rerank"):
+                    reranked = reranker.rerank(query, hits, trace=trace)
+                # Budget exceeded: keep the fused order
+                hits = reranked if reranked is not None else hits[:N_RESULTS]
+
+            self.cache.results.put(result_key, hits)
+            return hits
+
+        except Exception as e:
+            print(f"Retrieval failed: {e}")
+            trace.error("retrieval", e)
+        return []
+
+    def retrieve_for_turn(self, messages, trace=NULL_TRACE):
+        """
+        Retrieval for the last user message in the context of the conversation.
+        Follow-ups are rewritten into a standalone query; when they stay on the products of the
+        previous turn and its chunks already cover them, those chunks are reused without a new search.
+        Returns (query, hits).
+        """
+        self.cache.check_version()
+        previous = self.rewriter.previous_state(messages)
+        if previous is not None and previous["version"] != self.cache.version:
+            previous = None
+        question = messages[-1]["content"]
+        products = set()
+        if QUERY_ROUTING and len(messages) > 1:
+            try:
+                products = set(self.get_router().route(question))
+            except Exception as e:
+                # Same degradation as retrieve(): the turn goes on without routing
+                print(f"Routing failed: {e}")
+                trace.error("routing", e)
+        with trace.span("query_rewrite"):
+            query, subject = self.rewriter.rewrite(messages, previous, names_product=bool(products))
+
+        hits = None
+        if query != question:
+            trace.count("query_rewritten")
+            if previous is not None and previous["hits"]:
+                previous_sources = {hit["metadata"].get("source") for hit in previous["hits"]}
+                if products <= previous_sources and covers(question, previous["hits"]):
+                    trace.count("session_reuse")
+                    hits = previous["hits"]
+        if hits is None:
+            hits = self.retrieve(query, trace)
+        self.rewriter.save_state(messages, query, hits, self.cache.version, subject)
+        return query, hits
+
+    def get_rag_context(self, query):
+        """Retrieved chunks joined into one context string, with their distinct sources."""
+        hits = self.retrieve(query)
+        if not hits:
+            return None, None
+        sources = list(set(format_source(hit["metadata"]) for hit in hits))
+        return "\n---\n".join(hit["content"] for hit in hits), sources
+
+    def prepare_chat(self, messages, trace=NULL_TRACE, model=None):
+        """
+        Prepare the answer to the last user message of `messages`.
+        Returns {"faq", "cached", "sources", "messages", "hits"}: when "faq" or "cached" is set its "answer"
+        must be replayed as-is, otherwise "messages" is ready to send to Ollama and the final
+        answer can be handed back to remember_answer().
+        """
+        prompt = messages[-1]["content"]
+
+        # --- FAST PATH : réponse FAQ manuelle renvoyée telle quelle, sans appel au LLM ---
+        faq_hit = self.match_faq(prompt, trace)
+        if faq_hit:
+            return {"faq": faq_hit, "cached": None, "sources": ["manual_qa.json"], "messages": None}
+
+        query, hits = self.retrieve_for_turn(messages, trace)
+        with trace.span("prompt_build"):
+            # --- DETECT MANUAL FAQ HIT ---
+            is_manual_hit = any(hit["metadata"].get("source") == "manual_qa.json" for hit in hits)
+            system_prompt, token_stats = build_system_prompt([hit["content"] for hit in hits], is_manual_hit)
+            # Only cite the chunks that made it into the token budget
+            kept_hits = [hits[i] for i in token_stats.pop("kept")]
+            sources = list(set(format_source(hit["metadata"]) for hit in kept_hits))
+            history = list(messages[-HISTORY_MESSAGES:])
+            token_stats["history_tokens"] = sum(estimate_tokens(m["content"]) for m in history)
+            token_stats["prompt_tokens"] = token_stats["static_tokens"] + token_stats["context_tokens"] + token_stats["history_tokens"]
+
+        # --- CACHE DE RÉPONSES : même contexte et question quasi identique ---
+        answer_key = None
+        answer_cache = self.get_answer_cache() if model else None
+        if answer_cache is not None:
+            try:
+                # Tagged with the language typed by the user, so a French answer is not replayed in Arabic
+                answer_key = context_key(model, kept_hits, query_language(prompt))
+                # The standalone query: a bare follow-up means nothing without its conversation
+                query_embedding = self.get_query_embedding(query, trace)
+                with trace.span("answer_cache"):
+                    cached = answer_cache.lookup(answer_key, query_embedding)
+                if cached:
+                    trace.count("answer_cache_hit")
+                    return {"faq": None, "cached": cached, "sources": sources, "messages": None, "hits": hits}
+                trace.count("answer_cache_miss")
+            except Exception as e:
+                print(f"Answer cache lookup failed: {e}")
+                trace.error("answer_cache", e)
+
+        trace.set(prompt_tokens_estimate=token_stats["prompt_tokens"], chunks_packed=token_stats["chunks_packed"])
+        print(f"Prompt tokens (estimate): {token_stats}")
+        return {
+            "faq": None,
+            "cached": None,
+            "sources": sources,
+            "messages": [{"role": "system", "content": system_prompt}] + history,
+            "token_stats": token_stats,
+            "hits": hits,
+            "question": query,
+            "answer_key": answer_key,
+        }
+
+    def remember_answer(self, turn, answer):
+        """Store a completed LLM answer for the context of `turn` (returned by prepare_chat)."""
+        if not turn.get("answer_key") or not answer.strip():
+            return
+        try:
+            query_embedding = self.get_query_embedding(turn["question"])
+            self.get_answer_cache().store(turn["answer_key"], query_embedding, turn["question"], answer)
+        except Exception as e:
+            print(f"Answer cache store failed: {e}")
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline():
+    """Process-wide shared instance."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = RAGPipeline()
+    return _pipeline
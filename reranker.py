@@ -0,0 +1,97 @@
+import os
+import time
+import hashlib
+import threading
+from rag_cache import TTLCache, normalize_query
+from metrics import NULL_TRACE, record_cold_start
+
+# Configuration
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# Candidates fetched from the hybrid search, and chunks kept after re-ranking
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "3"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "8"))
+# Past this budget the remaining candidates are not scored and the fused order is kept
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "400"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+
+class Reranker:
+    """
+    Cross-encoder re-scoring of (query, chunk) pairs on CPU, in batches and under a time budget.
+    Scores are cached per (normalized query, chunk text), so a repeated question only pays for new chunks.
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE,
+                 budget_ms=RERANK_BUDGET_MS, cache_size=RERANK_CACHE_SIZE, device="cpu"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.device = device
+        self.scores = TTLCache(maxsize=cache_size)
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                print(f"Loading re-ranking model: {self.model_name}")
+                started = time.perf_counter()
+                self._model = CrossEncoder(self.model_name, device=self.device)
+                record_cold_start("rerank_model", time.perf_counter() - started)
+        return self._model
+
+    @staticmethod
+    def _key(query_key, text):
+        return query_key, hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def rerank(self, query, hits, top_k=RERANK_TOP_K, trace=NULL_TRACE):
+        """
+        Return the `top_k` best hits by cross-encoder score (stored in hit["rerank_score"]),
+        or None when the budget ran out before every candidate was scored.
+        """
+        if not hits:
+            return []
+        query_key = normalize_query(query)
+        scores = {}
+        missing = []
+        for i, hit in enumerate(hits):
+            score = self.scores.get(self._key(query_key, hit["content"]))
+            if score is None:
+                missing.append(i)
+            else:
+                scores[i] = score
+        trace.count("rerank_cache_hit", len(scores))
+
+        # Loaded before the clock starts: the cold start is not part of the budget
+        model = self.model if missing else None
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        last_batch = 0.0
+        for start in range(0, len(missing), self.batch_size):
+            # Stop before a batch that would likely overrun the budget
+            if time.perf_counter() + last_batch > deadline:
+                trace.count("rerank_budget_exceeded")
+                return None
+            batch = missing[start:start + self.batch_size]
+            batch_started = time.perf_counter()
+            predicted = model.predict([(query, hits[i]["content"]) for i in batch], batch_size=self.batch_size)
+            last_batch = time.perf_counter() - batch_started
+            for i, score in zip(batch, predicted):
+                scores[i] = float(score)
+                self.scores.put(self._key(query_key, hits[i]["content"]), scores[i])
+
+        ranked = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)[:top_k]
+        return [dict(hits[i], rerank_score=scores[i]) for i in ranked]
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    """Process-wide shared instance."""
+    global _reranker
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker()
+    return _reranker
@@ -1,6 +1,6 @@
 import chromadb
-from chromadb.utils import embedding_functions
 import os
+from embedding_service import get_embedding_service, get_collection
 
 DB_PATH = "chroma_db"
 COLLECTION_NAME = "bnm_qa"
@@ -11,11 +11,9 @@ def verify():
         return
 
     client = chromadb.PersistentClient(path=DB_PATH)
-    embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="paraphrase-multilingual-MiniLM-L12-v2"
-    )
+    embedding_service = get_embedding_service()
     
-    collection = client.get_collection(name=COLLECTION_NAME, embedding_function=embedding_function)
+    collection = get_collection(client, COLLECTION_NAME)
     
     count = collection.count()
     print(f"Total documents in collection: {count}")
@@ -37,7 +35,7 @@ def verify():
     # Sample query for "Qui es-tu ?"
     query = "Qui es-tu ?"
     print(f"\nTesting query: '{query}'")
-    query_results = collection.query(query_texts=[query], n_results=1)
+    query_results = collection.query(query_embeddings=[embedding_service.embed_query(query)], n_results=1)
     
     if query_results['documents'] and len(query_results['documents'][0]) > 0:
         print(f"Top result: {query_results['documents'][0][0]}")
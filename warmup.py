@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+import threading
+import argparse
+
+# Configuration
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+CHAT_API_URL = os.getenv("CHAT_API_URL", "")
+# Ollama models loaded at startup (comma-separated) and how long Ollama keeps them in memory when idle
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "qwen2.5:1.5b").split(",") if m.strip()]
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Written once the warm-up is done; read by the Docker HEALTHCHECK (python warmup.py --check)
+READY_FILE = os.getenv("READY_FILE", "/tmp/bnm_ready")
+WARMUP_QUERY = "Quels sont les frais de la carte ?"
+
+class Readiness:
+    """Progress of the warm-up, exposed by /ready and the ready file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self.steps = {}
+        self.errors = {}
+
+    def record(self, step, seconds=None, error=None):
+        with self._lock:
+            if error is not None:
+                self.errors[step] = f"{type(error).__name__}: {error}"
+            else:
+                self.steps[step] = round(seconds * 1000, 1)
+
+    def mark_ready(self, ready_file=READY_FILE):
+        with self._lock:
+            self.ready = True
+        if ready_file:
+            with open(ready_file, "w", encoding="utf-8") as f:
+                f.write(str(time.time()))
+
+    def status(self):
+        with self._lock:
+            return {"ready": self.ready, "steps_ms": dict(self.steps), "errors": dict(self.errors)}
+
+def _step(readiness, name, func):
+    started = time.perf_counter()
+    try:
+        func()
+        readiness.record(name, time.perf_counter() - started)
+    except Exception as e:
+        print(f"Warm-up step '{name}' failed: {e}")
+        readiness.record(name, error=e)
+
+def warm_up_pipeline(pipeline, readiness):
+    """Load the embedding model, open and pin the collection, then run one retrieval end to end."""
+    _step(readiness, "embedding_model", lambda: pipeline.embedding_service.embed_query("warm-up"))
+    _step(readiness, "collection", pipeline.get_collection)
+    _step(readiness, "faq_index", pipeline.get_faq_index)
+    # The dummy query also loads the BM25 index, the router and the re-ranker when enabled
+    _step(readiness, "retrieval", lambda: pipeline.retrieve(WARMUP_QUERY))
+
+def warm_up_ollama(client, models, readiness, keep_alive=OLLAMA_KEEP_ALIVE):
+    """An empty generate loads the model into Ollama's memory and keeps it there for `keep_alive`."""
+    for model in models:
+        _step(readiness, f"ollama:{model}", lambda: client.generate(model=model, prompt="", keep_alive=keep_alive))
+
+def warm_up(pipeline=None, client=None, models=WARMUP_MODELS, readiness=None, ready_file=READY_FILE):
+    """
+    Run every warm-up step and mark the process ready. Failed steps are reported but do not
+    block readiness: the component will then load on first use, as before.
+    """
+    readiness = readiness or Readiness()
+    if ready_file and os.path.exists(ready_file):
+        os.remove(ready_file)
+    started = time.perf_counter()
+    if pipeline is not None:
+        warm_up_pipeline(pipeline, readiness)
+    if client is not None:
+        warm_up_ollama(client, models, readiness)
+    readiness.mark_ready(ready_file)
+    print(f"Warm-up complete in {time.perf_counter() - started:.2f}s: {readiness.status()}")
+    return readiness
+
+_process_readiness = None
+_start_lock = threading.Lock()
+
+def start_warm_up(pipeline=None, client=None, models=WARMUP_MODELS, ready_file=READY_FILE):
+    """
+    Run warm_up() in a daemon thread, once per process; returns the Readiness object to poll.
+    Later calls (e.g. app.py after the --streamlit launcher) get the warm-up already running.
+    """
+    global _process_readiness
+    with _start_lock:
+        if _process_readiness is None:
+            _process_readiness = Readiness()
+            threading.Thread(target=warm_up, args=(pipeline, client, models, _process_readiness, ready_file),
+                             name="warm-up", daemon=True).start()
+        return _process_readiness
+
+def check_ready():
+    """Readiness probe: the chat server's /ready in thin-client mode, otherwise the ready file."""
+    if CHAT_API_URL:
+        import httpx
+        try:
+            return httpx.get(CHAT_API_URL.rstrip("/") + "/ready", timeout=5).status_code == 200
+        except httpx.HTTPError:
+            return False
+    return os.path.exists(READY_FILE)
+
+def run_streamlit(streamlit_args):
+    """
+    Serve app.py from this process, with the warm-up started in the background first: the models
+    it loads are the ones the app uses, and the ready file reflects the process that serves users.
+    """
+    if CHAT_API_URL:
+        # Thin client: the chat server does the heavy lifting and its own warm-up
+        print(f"Thin-client mode, warm-up is done by {CHAT_API_URL}.")
+    else:
+        import ollama
+        # Through the module app.py imports (this file runs as __main__), so that app.py finds this warm-up
+        import warmup
+        from rag_pipeline import get_pipeline
+        warmup.start_warm_up(get_pipeline(), ollama.Client(host=OLLAMA_HOST))
+    from streamlit.web import cli as stcli
+    sys.argv = ["streamlit", "run", "app.py"] + streamlit_args
+    sys.exit(stcli.main())
+
+def main():
+    parser = argparse.ArgumentParser(description="Préchargement des modèles avant l'arrivée des premiers utilisateurs.")
+    parser.add_argument("--check", action="store_true", help="Sonde de disponibilité (code de sortie 0 si prêt)")
+    parser.add_argument("--streamlit", action="store_true",
+                        help="Lancer app.py dans ce processus après le démarrage du préchargement (options Streamlit à la suite)")
+    args, streamlit_args = parser.parse_known_args()
+
+    if args.check:
+        sys.exit(0 if check_ready() else 1)
+    if args.streamlit:
+        run_streamlit(streamlit_args)
+        return
+    if streamlit_args:
+        parser.error(f"unrecognized arguments: {' '.join(streamlit_args)}")
+
+    if CHAT_API_URL:
+        print(f"Thin-client mode, warm-up is done by {CHAT_API_URL}.")
+        return
+    # One-shot preload of the Ollama models and of the on-disk caches. The models loaded in this
+    # process are gone when it exits, so it does not write the ready file.
+    import ollama
+    from rag_pipeline import get_pipeline
+    warm_up(get_pipeline(), ollama.Client(host=OLLAMA_HOST), ready_file=None)
+
+if __name__ == "__main__":
+    main()